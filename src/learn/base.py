@@ -0,0 +1,168 @@
+"""
+Helpers shared by the linear models
+"""
+import mmap
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from scipy import sparse
+from sklearn.utils import gen_batches
+from sklearn.utils.extmath import safe_sparse_dot
+
+
+def linear_scores(X, coef, intercept):
+    """
+    Args:
+        X: (m, n_features) samples, dense or sparse, or one (n_features,) sample
+        coef: (n_targets, n_features) weights, dense or scipy.sparse
+        intercept: (n_targets,)
+    Return:
+        X coef.T + intercept. A sparse coef only reads the columns of X
+        of its nonzero features.
+    """
+    if sparse.issparse(coef):
+        features = np.unique(coef.indices)
+        X = X[..., features] if isinstance(X, np.ndarray) else X[:, features]
+        coef = coef[:, features].toarray()
+    return safe_sparse_dot(X, coef.T) + intercept
+
+
+def shuffled_batches(indices, batch_size, rng):
+    """
+    Shuffle indices in place and yield the rows of every mini-batch.
+
+    Only the index array is permuted, so an epoch never copies the design
+    matrix, just the batch_size rows gathered for each update.
+    """
+    rng.shuffle(indices)
+    for batch in gen_batches(indices.shape[0], batch_size):
+        yield indices[batch]
+
+
+def regularization_path(estimator, X, y, c_lambdas):
+    """
+    Fit estimator for every value in c_lambdas, from the strongest
+    penalty to the weakest. warm_start is set, so each fit starts from
+    the previous solution and only needs a few iterations to converge.
+
+    Return:
+        c_lambdas: (n_lambdas,) the penalties in the order they were fitted
+        coefs: (n_lambdas,) + coef_.shape, coef_ of every fit
+        intercepts: (n_lambdas,) + intercept_.shape, intercept_ of every fit
+        n_iters: (n_lambdas,) n_iter_ of every fit
+    """
+    estimator.set_params(warm_start=True)
+    c_lambdas = np.sort(np.asarray(c_lambdas, dtype=float))[::-1]
+    coefs, intercepts, n_iters = [], [], []
+    for c_lambda in c_lambdas:
+        estimator.set_params(c_lambda=c_lambda).fit(X, y)
+        coefs.append(estimator.coef_.copy())
+        intercepts.append(estimator.intercept_.copy())
+        n_iters.append(estimator.n_iter_)
+    return c_lambdas, np.array(coefs), np.array(intercepts), np.array(n_iters)
+
+
+@contextmanager
+def shared_array(X):
+    """
+    Copy X once into shared memory and yield a small picklable handle
+    to it, which attach_shared_array turns back into an array in
+    another process without copying. The memory is released on exit.
+    """
+    shm = SharedMemory(create=True, size=max(X.nbytes, 1))
+    try:
+        shared = np.ndarray(X.shape, dtype=X.dtype, buffer=shm.buf)
+        shared[...] = X
+        del shared
+        yield shm.name, X.shape, X.dtype.str
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def attach_shared_array(handle):
+    """
+    Return:
+        X: the array behind a handle yielded by shared_array
+        shm: the SharedMemory to close once X is no longer used
+    """
+    name, shape, dtype = handle
+    shm = SharedMemory(name=name)
+    return np.ndarray(shape, dtype=dtype, buffer=shm.buf), shm
+
+
+@contextmanager
+def worker_array(X):
+    """
+    Yield a picklable handle that attach_worker_array turns back into X
+    in a worker process. A np.memmap of a file, like the arrays of
+    np.load(path, mmap_mode='r'), is reopened by every worker from the
+    file, so it is never loaded whole. Other arrays are copied once
+    into shared memory.
+    """
+    # views of a memmap share its filename and offset, only the array
+    # that owns the mapping can be reopened from them
+    if isinstance(X, np.memmap) and isinstance(X.base, mmap.mmap) and X.filename:
+        order = 'F' if X.flags.f_contiguous and not X.flags.c_contiguous else 'C'
+        yield 'memmap', (X.filename, X.dtype.str, X.shape, X.offset, order)
+    else:
+        with shared_array(np.ascontiguousarray(X)) as handle:
+            yield 'shared', handle
+
+
+def attach_worker_array(handle):
+    """
+    Return:
+        X: the array behind a handle yielded by worker_array
+        shm: the SharedMemory to close once X is no longer used, or None
+    """
+    kind, handle = handle
+    if kind == 'memmap':
+        filename, dtype, shape, offset, order = handle
+        return np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                         offset=offset, order=order), None
+    return attach_shared_array(handle)
+
+
+class LinearScoresMixin:
+    """
+    Decision function of a linear model from its coef_ and intercept_
+    """
+    def _decision_function(self, X):
+        """
+        Return:
+            X coef_.T + intercept_, see linear_scores, raveled to (m,)
+            for a single row of coef_
+        """
+        scores = linear_scores(X, self.coef_, self.intercept_)
+        return scores[..., 0] if scores.shape[-1] == 1 else scores
+
+
+class SparseCoefMixin(LinearScoresMixin):
+    """
+    sparsify and densify coef_ of a linear model, see linear_scores
+    """
+    def sparsify(self):
+        """
+        Store coef_ as a scipy.sparse CSR matrix, which keeps the index
+        and value of every nonzero weight. Worth it when most weights
+        are zero, e.g. after an l1 penalty: predictions then only touch
+        the features with a weight. Fitting again densifies coef_.
+
+        Return:
+            self
+        """
+        self.coef_ = sparse.csr_matrix(self.coef_)
+        return self
+
+    def densify(self):
+        """
+        Store coef_ as a numpy array again.
+
+        Return:
+            self
+        """
+        if sparse.issparse(getattr(self, 'coef_', None)):
+            self.coef_ = self.coef_.toarray()
+        return self
@@ -1,8 +1,9 @@
 import numpy as np
+from scipy.special import xlogy
 from scipy.stats import pearsonr
 from collections import Counter  
 from sklearn.base import BaseEstimator
-from math import log2
+from math import log, log2
 
 def get_pearsonr(feature, Y):
     return abs(pearsonr(feature, Y)[0])
@@ -33,19 +34,45 @@ def _partition_classes(X, y, split_attribute, split_val):
     y_right = y[~left_indices]
     return X_left, X_right, y_left, y_right
 
-def _find_best_split(X, y, split_attribute, y_entropy):
-    
-    vals = [x[split_attribute] for x in X]
-    unique_vals = np.unique(vals)
-    info_gains = []
-    for i in range(len(unique_vals)):
-        _, _, y_left, y_right = _partition_classes(X, y, split_attribute, unique_vals[i])
-        current_y = [y_left, y_right]
-        info_gains.append(_information_gain(current_y, y_entropy))
-    # print(info_gains)
-    max_idx = np.argmax(info_gains)
-    return unique_vals[max_idx], info_gains[max_idx]
+def _weighted_entropy(counts):
+    """len(y) * entropy(y) of every row of class counts"""
+    n = counts.sum(axis=1)
+    return (xlogy(n, n) - xlogy(counts, counts).sum(axis=1)) / log(2)
+
+def _first_max(values):
+    """index of the first maximum, ignoring rounding differences"""
+    values = np.asarray(values)
+    return np.flatnonzero(values >= values.max() - 1e-12)[0]
 
+def _find_best_split(X, y, split_attribute, y_entropy):
+    """
+    Sort the feature once and sweep the class counts left of every
+    threshold, O(n log n) instead of a partition per unique value. Like
+    the partitions, every unique value v is scored as the split x <= v.
+    """
+    order = np.argsort(X[:, split_attribute], kind='mergesort')
+    vals = X[order, split_attribute]
+    _, codes = np.unique(y, return_inverse=True)
+    left = np.cumsum(np.eye(codes.max() + 1)[codes[order]], axis=0)
+    # the last sorted row of every unique value
+    ends = np.append(np.flatnonzero(vals[1:] != vals[:-1]), vals.shape[0] - 1)
+    left = left[ends]
+    right = left[-1] - left
+    info_gains = y_entropy - (_weighted_entropy(left) + _weighted_entropy(right)) / vals.shape[0]
+    max_idx = _first_max(info_gains)
+    return vals[ends[max_idx]], info_gains[max_idx]
+
+
+def _bin_edges(x, max_bins):
+    """
+    Thresholds of at most max_bins quantile bins of x, bin b holds
+    edges[b - 1] < x <= edges[b]. With at most max_bins unique values
+    every value gets its own bin, like the exact split search.
+    """
+    vals = np.unique(x)
+    if vals.shape[0] <= max_bins:
+        return vals[:-1]
+    return np.unique(np.quantile(x, np.linspace(0, 1, max_bins + 1)[1:-1]))
 
 def _find_best_feature(X, y):
     
@@ -67,7 +94,7 @@ def _find_best_feature(X, y):
             info_gains.append(info_gain)
             split_vals.append(split_val)
     # print(info_gains)
-    max_idx = np.argmax(info_gains)
+    max_idx = _first_max(info_gains)
     return split_attributes[max_idx], split_vals[max_idx]
 
 
@@ -203,15 +230,34 @@ class DecisionTree(BaseEstimator):
 
 
 class DecisionTreeD(BaseEstimator):
+    """
+    Parameters
+    ----------
+    max_bins : int, default None
+        None searches exact thresholds. Otherwise every feature is
+        binned once into at most max_bins <= 255 quantile bins, stored as
+        uint8, and splits are searched on per node class histograms of
+        the bins, O(max_bins) per feature. Only the smaller child is
+        histogrammed, the other one is its parent minus it.
+
+    Attributes
+    ----------
+    classes_ : array
+        Labels, only set with max_bins.
+    bin_edges_ : list of arrays
+        Thresholds of the bins of every feature, only set with max_bins.
+    """
     def __init__(self,
                     leaf_size = 1,
                     max_depth = None,
                     verbose = True,
-                    depth = 0):
+                    depth = 0,
+                    max_bins = None):
         self.max_depth = max_depth
         self.leaf_size = leaf_size
         self.verbose = verbose
         self.depth = depth
+        self.max_bins = max_bins
         self.is_leaf = False
 
     def _cannot_split(self, c):
@@ -232,6 +278,8 @@ class DecisionTreeD(BaseEstimator):
 
 
     def fit(self, X, y):
+        if self.max_bins is not None:
+            return self._fit_histogram(X, y)
         if self.verbose:
             print(np.array(X).shape, np.array(y).shape, 'depth=', self.depth)
         
@@ -257,6 +305,86 @@ class DecisionTreeD(BaseEstimator):
         self.right = right_node.fit(X_right, y_right)
         return self
 
+    def _fit_histogram(self, X, y):
+        if not 2 <= self.max_bins <= 255:
+            raise ValueError("max_bins should be in [2, 255], got %r" % self.max_bins)
+        X = np.asarray(X)
+        self.classes_, codes = np.unique(y, return_inverse=True)
+        self.bin_edges_ = [_bin_edges(X[:, f], self.max_bins) for f in range(X.shape[1])]
+        X_binned = np.empty(X.shape, dtype=np.uint8)
+        for f, edges in enumerate(self.bin_edges_):
+            X_binned[:, f] = np.searchsorted(edges, X[:, f], side='left')
+        return self._grow(X_binned, codes, self._histogram(X_binned, codes))
+
+    def _histogram(self, X_binned, codes):
+        """(n_features, max_bins, n_classes) class counts of every bin"""
+        n_classes = self.classes_.shape[0]
+        hist = np.empty((X_binned.shape[1], self.max_bins, n_classes), dtype=np.intp)
+        for f in range(X_binned.shape[1]):
+            hist[f] = np.bincount(X_binned[:, f].astype(np.intp) * n_classes + codes,
+                                  minlength=self.max_bins * n_classes).reshape(self.max_bins, n_classes)
+        return hist
+
+    def _find_best_bin(self, hist):
+        """
+        Return:
+            feature and bin of the split bin <= b with the most
+            information gain, None when no threshold splits the node
+        """
+        n_features, n_bins, n_classes = hist.shape
+        left = np.cumsum(hist, axis=1)[:, :-1]
+        total = left[:, -1:] + hist[:, -1:]
+        right = total - left
+        n = total[0].sum()
+        y_entropy = _weighted_entropy(total[0]).item() / n
+        info_gains = y_entropy - (_weighted_entropy(left.reshape(-1, n_classes)) +
+                                  _weighted_entropy(right.reshape(-1, n_classes))) / n
+        info_gains = info_gains.reshape(n_features, n_bins - 1)
+        n_edges = np.array([edges.shape[0] for edges in self.bin_edges_])
+        valid = ((np.arange(n_bins - 1) < n_edges[:, np.newaxis]) &
+                 (left.sum(axis=2) > 0) & (right.sum(axis=2) > 0))
+        if not valid.any():
+            return None
+        info_gains[~valid] = -np.inf
+        return np.unravel_index(_first_max(info_gains.ravel()), info_gains.shape)
+
+    def _grow(self, X_binned, codes, hist):
+        if self.verbose:
+            print(X_binned.shape, codes.shape, 'depth=', self.depth)
+
+        c = Counter(dict(zip(self.classes_, hist[0].sum(axis=0))))
+
+        if self.max_depth and self.depth >= self.max_depth:
+            return self.get_leaf_node(c)
+
+        split = None if self._cannot_split(c) else self._find_best_bin(hist)
+        if split is None:
+            return self.get_leaf_node(c)
+
+        feature_to_split, split_bin = split
+        self.feature_to_split = feature_to_split
+        self.split_val = self.bin_edges_[feature_to_split][split_bin]
+        self.val = self._get_val(c)
+
+        left_index = X_binned[:, feature_to_split] <= split_bin
+        n_left = np.count_nonzero(left_index)
+        small = left_index if n_left <= left_index.shape[0] - n_left else ~left_index
+        small_hist = self._histogram(X_binned[small], codes[small])
+        if small is left_index:
+            left_hist, right_hist = small_hist, hist - small_hist
+        else:
+            left_hist, right_hist = hist - small_hist, small_hist
+
+        children = []
+        for index, child_hist in [(left_index, left_hist), (~left_index, right_hist)]:
+            node = DecisionTreeD(leaf_size=self.leaf_size, max_depth=self.max_depth,
+                                 verbose=self.verbose, depth=self.depth + 1,
+                                 max_bins=self.max_bins)
+            node.classes_, node.bin_edges_ = self.classes_, self.bin_edges_
+            children.append(node._grow(X_binned[index], codes[index], child_hist))
+        self.left, self.right = children
+        return self
+
     def _search_point(self, point, tree):
         if tree.is_leaf:
             return tree.val
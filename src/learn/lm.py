@@ -4,30 +4,458 @@ Linear Model
 Linear Regression
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
+from numpy.linalg import LinAlgError
+from scipy import sparse
+from scipy.linalg import cho_factor, cho_solve, get_lapack_funcs, qr, solve_triangular
+from scipy.sparse.linalg import LinearOperator, cg, lsmr, lsqr
 
 from sklearn.base import BaseEstimator
 from sklearn.metrics import r2_score
-from sklearn.metrics import mean_squared_error as mse
+from sklearn.utils import gen_batches
+from sklearn.utils.extmath import safe_sparse_dot
+
+from .base import (SparseCoefMixin, attach_worker_array, linear_scores, regularization_path,
+                   shuffled_batches, worker_array)
+from .optim import ConvergenceMonitor, Penalty, cost_sample_rows, get_optimizer
+
+DIRECT_SOLVERS = ('auto', 'cholesky', 'qr', 'lstsq', 'svd')
+ITERATIVE_SOLVERS = ('cg', 'lsqr', 'lsmr')
+SOLVERS = DIRECT_SOLVERS + ITERATIVE_SOLVERS
+
+
+def _check_solver(solver, solvers=SOLVERS):
+    if solver not in solvers:
+        raise ValueError("solver should be one of %s, got %r"
+                         % (", ".join(map(repr, solvers)), solver))
+
+
+def _augment(X, y, ridge):
+    """
+    Rows that turn the ridge penalty into ordinary least squares,
+    |X w - y|^2 + sum(ridge * w^2) = |[X; sqrt(ridge)] w - [y; 0]|^2
+    """
+    if ridge is None or not np.any(ridge):
+        return X, y
+    X = np.vstack((X, np.diag(np.sqrt(ridge))))
+    y = np.concatenate((y, np.zeros((X.shape[1],) + y.shape[1:])))
+    return X, y
+
+
+def _cholesky(gram, Xty, check_condition):
+    """
+    Solve gram w = Xty, None when gram is singular or, with
+    check_condition, too badly conditioned for the normal equation.
+    """
+    anorm = np.abs(gram).sum(axis=0).max()
+    try:
+        factor = cho_factor(gram)
+    except LinAlgError:
+        return None
+    if check_condition:
+        pocon, = get_lapack_funcs(('pocon',), (factor[0],))
+        rcond, info = pocon(factor[0], anorm)
+        # the normal equation squares the condition number of X, keep
+        # it to cases that still leave half the digits
+        if info != 0 or rcond < np.sqrt(np.finfo(float).eps):
+            return None
+    return cho_solve(factor, Xty)
+
+
+def _centered_gram(X, x_offset, chunk_size=65536):
+    """(X - x_offset).T (X - x_offset), centering one chunk of rows at a time"""
+    gram = np.zeros((X.shape[1], X.shape[1]))
+    for batch in gen_batches(X.shape[0], chunk_size):
+        Xc = X[batch] - x_offset
+        gram += np.dot(Xc.T, Xc)
+    return gram
+
+
+def least_squares(X, y, solver='auto', ridge=None, x_offset=None):
+    """
+    Solve min_w |X w - y|^2 + sum(ridge * w^2).
+
+    'cholesky' factors the (d, d) Gram matrix X.T X + diag(ridge), the
+    cheapest for m >> d but it squares the condition number of X. 'qr'
+    works on X itself and needs full column rank, it falls back to
+    'lstsq' when there are fewer rows than columns. 'lstsq' (LAPACK
+    gelsd) and 'svd' give the minimum norm solution of rank deficient
+    problems like pinv. 'auto' takes 'cholesky' when m >= d and the Gram matrix is
+    well conditioned, 'lstsq' otherwise. No solver forms an inverse or a
+    (d, m) product, the penalty becomes d extra rows of X for all but
+    'cholesky'.
+
+    Args:
+        X: (m, d)
+        y: (m,) or (m, k) targets
+        solver: 'auto', 'cholesky', 'qr', 'lstsq' or 'svd', see
+            iterative_least_squares for the iterative solvers
+        ridge: (d,) penalty of every weight, None for none
+        x_offset: (d,) solve for X - x_offset instead, e.g. the column
+            means to fit an intercept. 'cholesky' centers X a chunk of
+            rows at a time, the other solvers need a copy of X anyway.
+    Return:
+        w: (d,) or (d, k)
+    """
+    _check_solver(solver, DIRECT_SOLVERS)
+    m, d = X.shape
+    if solver == 'cholesky' or (solver == 'auto' and m >= d):
+        if x_offset is None:
+            gram, Xty = np.dot(X.T, X), np.dot(X.T, y)
+        else:
+            gram = _centered_gram(X, x_offset)
+            Xty = np.dot(X.T, y) - np.multiply.outer(x_offset, np.sum(y, axis=0))
+        if ridge is not None:
+            gram.flat[::d + 1] += ridge
+        w = _cholesky(gram, Xty, check_condition=solver == 'auto')
+        if w is not None:
+            return w
+        solver = 'lstsq'
+
+    if x_offset is not None:
+        X = X - x_offset
+    X, y = _augment(X, y, ridge)
+    if solver == 'qr' and X.shape[0] < X.shape[1]:
+        solver = 'lstsq'
+    if solver in ('auto', 'lstsq'):
+        return np.linalg.lstsq(X, y, rcond=None)[0]
+    if solver == 'qr':
+        Q, R = qr(X, mode='economic')
+        return solve_triangular(R, np.dot(Q.T, y))
+    U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    keep = s > s[0] * max(X.shape) * np.finfo(float).eps
+    Uty = np.dot(U[:, keep].T, y)
+    return np.dot(Vt[keep].T, (Uty.T / s[keep]).T)
+
+
+def solve_normal_equations(gram, Xty, ridge=None):
+    """
+    Solve (gram + diag(ridge)) w = Xty, with Cholesky, or the minimum
+    norm solution of lstsq when the system is singular.
+
+    Args:
+        gram: (d, d) X.T X, left unchanged
+        Xty: (d,) or (d, k) X.T y
+        ridge: (d,) penalty of every weight, None for none
+    """
+    gram = gram.copy()
+    if ridge is not None:
+        gram.flat[::gram.shape[0] + 1] += ridge
+    w = _cholesky(gram, Xty, check_condition=True)
+    if w is None:
+        w = np.linalg.lstsq(gram, Xty, rcond=None)[0]
+    return w
 
-class LinearRegression(BaseEstimator):
+
+def _centered_operator(X, x_mean):
+    """
+    X - x_mean as a LinearOperator, the centering is applied to every
+    product so a sparse X stays sparse
+    """
+    def matvec(v):
+        v = np.ravel(v)
+        return safe_sparse_dot(X, v) - np.dot(x_mean, v)
+
+    def rmatvec(u):
+        u = np.ravel(u)
+        return safe_sparse_dot(X.T, u) - x_mean * u.sum()
+
+    return LinearOperator(X.shape, matvec=matvec, rmatvec=rmatvec, dtype=np.float64)
+
+
+def iterative_least_squares(X, y, solver='lsqr', alpha=0, fit_intercept=True,
+                            tol=1e-6, max_iter=None):
+    """
+    Solve min_w,b |X w + b - y|^2 + alpha |w|^2 from products with X and
+    X.T only, so a scipy.sparse X takes memory in its nonzeros instead of
+    d^2. The intercept is fitted on implicitly centered X and y and is
+    not penalized.
+
+    'lsqr' and 'lsmr' work on X and take alpha as their damping, 'cg'
+    runs conjugate gradients on X.T X + alpha I without forming it, its
+    convergence depends on the squared condition number of X.
+
+    Args:
+        X: (m, d) array or scipy.sparse matrix
+        y: (m,) or (m, k) targets, every column is solved on its own
+        solver: 'cg', 'lsqr' or 'lsmr'
+        alpha: weight of the squared norm of w
+        tol: relative tolerance, the residual tolerance of 'cg' and
+            atol, btol of 'lsqr' and 'lsmr'
+        max_iter: iteration cap of every target, None for the default
+            of the solver
+    Return:
+        w: (d, k)
+        b: (k,)
+        n_iter: (k,) iterations taken for every target
+    """
+    _check_solver(solver, ITERATIVE_SOLVERS)
+    Y = np.asarray(y, dtype=np.float64).reshape((X.shape[0], -1))
+    d = X.shape[1]
+    if fit_intercept:
+        x_mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+        y_mean = Y.mean(axis=0)
+    else:
+        x_mean, y_mean = np.zeros(d), np.zeros(Y.shape[1])
+    A = _centered_operator(X, x_mean)
+
+    w = np.empty((d, Y.shape[1]))
+    n_iter = np.empty(Y.shape[1], dtype=int)
+    for k in range(Y.shape[1]):
+        target = Y[:, k] - y_mean[k]
+        if solver == 'cg':
+            normal = LinearOperator((d, d), dtype=np.float64,
+                                    matvec=lambda v: A.rmatvec(A.matvec(v)) + alpha * np.ravel(v))
+            steps = []
+            w[:, k] = cg(normal, A.rmatvec(target), rtol=tol, maxiter=max_iter,
+                         callback=steps.append)[0]
+            n_iter[k] = len(steps)
+        elif solver == 'lsqr':
+            w[:, k], _, n_iter[k] = lsqr(A, target, damp=np.sqrt(alpha), atol=tol,
+                                         btol=tol, iter_lim=max_iter)[:3]
+        else:
+            w[:, k], _, n_iter[k] = lsmr(A, target, damp=np.sqrt(alpha), atol=tol,
+                                         btol=tol, maxiter=max_iter)[:3]
+    return w, y_mean - np.dot(x_mean, w), n_iter
+
+
+class NormalEquations:
+    """
+    Sufficient statistics of a least squares problem, accumulated chunk
+    by chunk with update, so m rows only take (n_features, n_features)
+    memory.
+
+    The statistics are kept around the running means and combined with
+    the pairwise update of Chan et al., which stays accurate when the
+    features have large means, unlike subtracting n mean mean.T from
+    a raw X.T X at the end.
+
+    Attributes
+    ----------
+    n_samples_ : int
+    x_mean_ : array, shape (n_features,)
+    y_mean_ : array, shape (n_targets,)
+    xx_ : array, shape (n_features, n_features)
+        Centered X.T X.
+    xy_ : array, shape (n_features, n_targets)
+        Centered X.T y.
+    """
+    def __init__(self):
+        self.n_samples_ = 0
+
+    def update(self, X, y):
+        """
+        Add the rows of X and targets y, (m,) or (m, n_targets).
+
+        Return:
+            self
+        """
+        X = np.asarray(X, dtype=float)
+        y = np.asarray(y, dtype=float).reshape(X.shape[0], -1)
+        chunk = NormalEquations()
+        chunk.n_samples_ = X.shape[0]
+        chunk.x_mean_, chunk.y_mean_ = X.mean(axis=0), y.mean(axis=0)
+        X = X - chunk.x_mean_
+        chunk.xx_ = np.dot(X.T, X)
+        chunk.xy_ = np.dot(X.T, y - chunk.y_mean_)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """
+        Add the statistics of other, accumulated on other rows.
+
+        Return:
+            self
+        """
+        if not other.n_samples_:
+            return self
+        if not self.n_samples_:
+            self.n_samples_ = other.n_samples_
+            self.x_mean_, self.y_mean_ = other.x_mean_.copy(), other.y_mean_.copy()
+            self.xx_, self.xy_ = other.xx_.copy(), other.xy_.copy()
+            return self
+
+        n = self.n_samples_ + other.n_samples_
+        dx = other.x_mean_ - self.x_mean_
+        dy = other.y_mean_ - self.y_mean_
+        scale = self.n_samples_ * other.n_samples_ / n
+        self.xx_ += other.xx_ + scale * np.outer(dx, dx)
+        self.xy_ += other.xy_ + scale * np.outer(dx, dy)
+        self.x_mean_ += dx * other.n_samples_ / n
+        self.y_mean_ += dy * other.n_samples_ / n
+        self.n_samples_ = n
+        return self
+
+    def solve(self, fit_intercept=True, ridge=None):
+        """
+        Args:
+            fit_intercept: solve the centered problem and recover the
+                intercept from the means, which leaves it unpenalized
+            ridge: (n_features,) penalty of every coefficient
+        Return:
+            coef: (n_features, n_targets)
+            intercept: (n_targets,), zero without fit_intercept
+        """
+        if not self.n_samples_:
+            raise ValueError("no samples were accumulated")
+        if fit_intercept:
+            coef = solve_normal_equations(self.xx_, self.xy_, ridge)
+            return coef, self.y_mean_ - np.dot(self.x_mean_, coef)
+
+        gram = self.xx_ + self.n_samples_ * np.outer(self.x_mean_, self.x_mean_)
+        Xty = self.xy_ + self.n_samples_ * np.outer(self.x_mean_, self.y_mean_)
+        coef = solve_normal_equations(gram, Xty, ridge)
+        return coef, np.zeros(coef.shape[1])
+
+
+def _accumulate_rows(X, y, start, stop, chunk_size):
+    """NormalEquations of the rows start:stop of X, y holds their targets"""
+    stats = NormalEquations()
+    for begin in range(start, stop, chunk_size):
+        end = min(begin + chunk_size, stop)
+        stats.update(X[begin:end], y[begin - start:end - start])
+    return stats
+
+
+def _normal_equations_block(X_handle, y, start, stop, chunk_size):
+    """Worker of normal_equations"""
+    X, shm = attach_worker_array(X_handle)
+    try:
+        return _accumulate_rows(X, y, start, stop, chunk_size)
+    finally:
+        del X
+        if shm is not None:
+            shm.close()
+
+
+def normal_equations(X, y, n_jobs=None, chunk_size=65536):
+    """
+    Accumulate the NormalEquations of X, y chunk by chunk, with the rows
+    split into n_jobs contiguous blocks, each summed by its own process,
+    and the partial statistics merged at the end.
+
+    X can be a np.memmap, e.g. from np.load(path, mmap_mode='r'). The
+    workers then map the file themselves and only chunk_size rows of it
+    are in memory per process at a time. Other arrays are copied once
+    into shared memory.
+
+    Args:
+        X: (m, n_features)
+        y: (m,) or (m, n_targets), sent to the workers
+        n_jobs: number of processes, None or 1 sums in this process,
+            -1 uses all CPUs
+        chunk_size: number of rows in every product
+    Return:
+        NormalEquations, what LinearRegression(n_jobs=...) and
+        Ridge(n_jobs=...) solve
+    """
+    m = X.shape[0]
+    n_jobs = os.cpu_count() if n_jobs == -1 else (n_jobs or 1)
+    n_jobs = max(1, min(n_jobs, m))
+    if n_jobs == 1:
+        return _accumulate_rows(X, y, 0, m, chunk_size)
+
+    bounds = np.linspace(0, m, n_jobs + 1).astype(int)
+    stats = NormalEquations()
+    with worker_array(X) as X_handle, ProcessPoolExecutor(n_jobs) as pool:
+        futures = [pool.submit(_normal_equations_block, X_handle, np.asarray(y[start:stop]),
+                               start, stop, chunk_size)
+                   for start, stop in zip(bounds[:-1], bounds[1:])]
+        for future in futures:
+            stats.merge(future.result())
+    return stats
+
+
+class LinearModelMixin:
+    """
+    coef_, intercept_ and predict of a model solved into weights, the
+    intercept in its first row when fit_intercept.
+    """
+    @property
+    def intercept_(self):
+        if self.fit_intercept:
+            return self.weights[0]
+        return np.array([0])
+
+    @property
+    def coef_(self):
+        if self.fit_intercept:
+            return self.weights[1:]
+        return self.weights
+
+    def predict(self, X):
+        if not self.fit_intercept:
+            return safe_sparse_dot(X, self.weights)
+        return safe_sparse_dot(X, self.coef_) + self.intercept_
+
+
+class LinearRegression(LinearModelMixin, BaseEstimator):
     """
     Solve theta analytically using normal equation
+
+    Parameters
+    ----------
+    penalty : None or 'l2', default None
+        'l2' adds c_lambda times the squared norm of coef_, the intercept
+        is not penalized.
+    solver : {'auto', 'cholesky', 'qr', 'lstsq', 'svd', 'cg', 'lsqr', 'lsmr'}, default 'auto'
+        See least_squares. Models built with partial_fit, n_jobs or from
+        a np.memmap are solved from the Gram matrix, see
+        solve_normal_equations. 'cg', 'lsqr' and 'lsmr' only take
+        products with X and accept scipy.sparse X, see
+        iterative_least_squares. 'auto' takes 'lsqr' for a sparse X.
+    tol : float, default 1e-6
+        Tolerance of the iterative solvers.
+    max_iter : int, default None
+        Iteration cap of the iterative solvers, None for their default.
+    n_jobs : int, default None
+        Number of processes that sum X.T X and X.T y over blocks of rows,
+        see normal_equations. None or 1 solves X in memory with solver,
+        unless X is a np.memmap, which is always summed chunk by chunk.
+
+    Attributes
+    ----------
+    stats_ : NormalEquations
+        Statistics of the chunks passed to partial_fit.
+    n_iter_ : array, shape (n_targets,), or None
+        Iterations of every target of the iterative solvers, None for
+        the direct ones.
     """
     def __init__(self, 
                     fit_intercept = True,
                     penalty = None,
-                    c_lambda = 0):
+                    c_lambda = 0,
+                    solver = 'auto',
+                    n_jobs = None,
+                    tol = 1e-6,
+                    max_iter = None):
         
         self.fit_intercept = fit_intercept
         self.penalty = penalty
         self.c_lambda = c_lambda
-        self.penalty = penalty
+        self.solver = solver
+        self.n_jobs = n_jobs
+        self.tol = tol
+        self.max_iter = max_iter
 
     def _fit_intercept(self, X):
         intercept = np.ones((X.shape[0], 1))
         return np.hstack((intercept, X))
 
+    def _alpha(self):
+        """weight of the squared norm of coef_"""
+        return 0 if self.penalty is None else self.c_lambda
+
+    def _ridge(self, c_lambda):
+        """penalty of every weight, none on the intercept"""
+        ridge = np.full(self.n, float(c_lambda))
+        if self.fit_intercept:
+            ridge[0] = 0
+        return ridge
+
     def fit(self, X, y):
         """
         Args:
@@ -36,54 +464,153 @@ class LinearRegression(BaseEstimator):
         Return:
             self
         """
-        if self.fit_intercept:
-            X = self._fit_intercept(X)
-            self.m, self.n = X.shape
-            if self.penalty is None:
-                self.weights = np.linalg.pinv(X.T.dot(X)).dot(X.T).dot(y)
-            else:
-                L = np.eye(self.n)
-                L[0,0] = 0
-                self.c_lambda *= L
-                self.weights = np.linalg.pinv(X.T.dot(X) + self.c_lambda).dot(X.T).dot(y)
-        else:
-            self.m, self.n = X.shape
-            if self.penalty is None:
-                self.weights = np.linalg.pinv(X.T.dot(X)).dot(X.T).dot(y)
-            else:
-                L = np.eye(self.n)
-                self.c_lambda *= L
-                self.weights = np.linalg.pinv(X.T.dot(X) + self.c_lambda).dot(X.T).dot(y)
+        _check_solver(self.solver)
+        solver = self.solver
+        if solver == 'auto' and sparse.issparse(X):
+            solver = 'lsqr'
+        if hasattr(self, 'stats_'):
+            del self.stats_
+        self.n_iter_ = None
+        if solver in ITERATIVE_SOLVERS:
+            coef, intercept, self.n_iter_ = iterative_least_squares(
+                X, y, solver, self._alpha(), self.fit_intercept, self.tol, self.max_iter)
+            self.m, self.n = X.shape[0], X.shape[1] + int(self.fit_intercept)
+            self._set_weights(coef, intercept, np.ndim(y) == 1)
+            return self
 
+        if self.n_jobs not in (None, 1) or isinstance(X, np.memmap):
+            self.stats_ = normal_equations(X, y, self.n_jobs)
+            self._single_target = np.ndim(y) == 1
+            return self.finalize()
+
+        self.m, self.n = X.shape[0], X.shape[1] + int(self.fit_intercept)
+        ridge = self._ridge(self._alpha())[int(self.fit_intercept):] if self._alpha() else None
+        if not self.fit_intercept:
+            self.weights = least_squares(X, y, solver, ridge)
+            return self
+        # the unpenalized intercept is solved on centered X and y
+        # instead of a copy of X with a column of ones
+        x_mean, y_mean = X.mean(axis=0), np.mean(y, axis=0)
+        coef = least_squares(X, y - y_mean, solver, ridge, x_offset=x_mean)
+        intercept = y_mean - np.dot(x_mean, coef)
+        self._set_weights(coef.reshape((X.shape[1], -1)), np.reshape(intercept, -1),
+                          np.ndim(y) == 1)
         return self
 
-    @property
-    def intercept_(self):
-        if self._fit_intercept:
-            return self.weights[0]
-        return np.array([0])
+    def partial_fit(self, X, y):
+        """
+        Accumulate X.T X, X.T y and the means of the chunk X, y, call
+        finalize once every chunk was seen. This fits the same model as
+        fit on all the rows, in (n_features, n_features) memory:
 
-    @property
-    def coef_(self):
-        if self._fit_intercept:
-            return self.weights[1:]
-        return self.weights
+            reg = LinearRegression()
+            for chunk in pd.read_csv(path, chunksize=100000):
+                reg.partial_fit(chunk[features].values, chunk[target].values)
+            reg.finalize()
 
-    def predict(self, X):
+        Return:
+            self
+        """
+        if not hasattr(self, 'stats_'):
+            self.stats_ = NormalEquations()
+        self.stats_.update(X, y)
+        self._single_target = np.ndim(y) == 1
+        return self
+
+    def finalize(self):
+        """
+        Solve the model of the chunks passed to partial_fit so far, more
+        chunks can still be added and solved again later.
+
+        Return:
+            self
+        """
+        if not hasattr(self, 'stats_'):
+            raise ValueError("call partial_fit before finalize")
+        n_features = self.stats_.x_mean_.shape[0]
+        self.m, self.n = self.stats_.n_samples_, n_features + int(self.fit_intercept)
+        ridge = self._ridge(self._alpha())[int(self.fit_intercept):] if self._alpha() else None
+        coef, intercept = self.stats_.solve(self.fit_intercept, ridge)
+        self._set_weights(coef, intercept, self._single_target)
+        self.n_iter_ = None
+        return self
+
+    def _set_weights(self, coef, intercept, single_target):
+        """weights from a (d, k) coef and a (k,) intercept"""
         if self.fit_intercept:
-            X = self._fit_intercept(X)
-        
-        return np.dot(X, self.weights)
+            coef = np.vstack((intercept, coef))
+        self.weights = coef[:, 0] if single_target else coef
 
 
 
-class SGDRegressor(BaseEstimator):
+class SGDRegressor(SparseCoefMixin, BaseEstimator):
+    """
+    Parameters
+    ----------
+    penalty : {None, 'l2', 'l1', 'elasticnet'}, default None
+        Penalty on coef_ of strength c_lambda, see learn.optim.Penalty.
+        The l1 part is applied as a proximal (soft-thresholding) step
+        after every update, exact for optimizer='sgd'. Small weights
+        end exactly at zero, see sparsify.
+    l1_ratio : float, default 0.15
+        Share of the l1 part of the 'elasticnet' penalty.
+    batch : bool, default False
+        Update on the gradient of the whole data set every epoch.
+    batch_size : int, default None
+        Without batch, number of rows in every update, each a single
+        vectorized product. None or 1 updates on one sample at a time.
+    shuffle : bool, default False
+        Visit the mini-batches in a new random order every epoch, only
+        an index permutation is shuffled, never X.
+    tol : float or None, default None
+        With batch=True stop once the largest absolute entry of the
+        gradient falls below tol, otherwise stop once the training RMSE
+        has not improved by tol for n_iter_no_change epochs.
+        None always runs max_iter epochs.
+    n_iter_no_change : int, default 5
+    warm_start : bool, default False
+        Start fit from the coef_ and intercept_ of the previous fit when
+        the number of features matches, see sgd_regression_path.
+    optimizer : {'sgd', 'momentum', 'nesterov', 'adagrad', 'rmsprop', 'adam'}, default 'sgd'
+        Update rule, see learn.optim. The adaptive ones cope much better
+        with badly scaled features.
+    momentum : float, default 0.9
+        Used by the 'momentum' and 'nesterov' optimizers.
+    cost_every : int, default 1
+        Only record the training RMSE every cost_every epochs. Without
+        batch it takes an extra pass over X, which this skips. The
+        n_iter_no_change counts recorded costs.
+    cost_sample : int, float or None, default None
+        Evaluate the RMSE on a fixed random subsample of this many rows,
+        or of this fraction of the rows, instead of all of them.
+    random_state : int or None, default None
+        Seed of the shuffling and of the cost_sample subsample.
 
+    Attributes
+    ----------
+    n_iter_ : int
+        Number of epochs run.
+    costs : array, shape (n_costs,)
+        Training RMSE of every recorded epoch.
+    cost_iters_ : array, shape (n_costs,)
+        Epoch of every entry of costs, counted from 0.
+    """
     def __init__(self, fit_intercept=True, max_iter=1000,
                     learning_rate=0.001,
                     penalty=None,
                     c_lambda=0,
-                    batch=False):
+                    batch=False,
+                    tol=None,
+                    n_iter_no_change=5,
+                    warm_start=False,
+                    optimizer='sgd',
+                    momentum=0.9,
+                    cost_every=1,
+                    cost_sample=None,
+                    random_state=None,
+                    l1_ratio=0.15,
+                    batch_size=None,
+                    shuffle=False):
 
         self.fit_intercept = fit_intercept
         self.max_iter = int(max_iter)
@@ -91,108 +618,381 @@ class SGDRegressor(BaseEstimator):
         self.penalty = penalty
         self.c_lambda = c_lambda
         self.batch = batch
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.warm_start = warm_start
+        self.optimizer = optimizer
+        self.momentum = momentum
+        self.cost_every = cost_every
+        self.cost_sample = cost_sample
+        self.random_state = random_state
+        self.l1_ratio = l1_ratio
+        self.batch_size = batch_size
+        self.shuffle = shuffle
 
 
     def fit(self, X, y):
-        if self.fit_intercept:
-            self.intercept_ = np.zeros(shape=(1,))
         self.m, n_features = X.shape
-        self.coef_ = np.zeros(shape=(1, n_features))
+        self.densify()
+        if not (self.warm_start and hasattr(self, 'coef_')
+                and self.coef_.shape[1] == n_features):
+            self.intercept_ = np.zeros(shape=(1,))
+            self.coef_ = np.zeros(shape=(1, n_features))
+        if self.cost_every < 1:
+            raise ValueError("cost_every should be at least 1, "
+                             "got %r" % self.cost_every)
         self.costs = np.empty((self.max_iter, ))
+        cost_iters = []
 
-        y.shape = (self.m, 1)
+        y = y.reshape((self.m, 1))
+        monitor = ConvergenceMonitor(self.tol, self.n_iter_no_change)
+        self.optimizer_ = get_optimizer(self.optimizer, self.learning_rate, self.momentum)
+        self.penalty_ = Penalty(self.penalty, self.c_lambda, self.l1_ratio)
+        rows = cost_sample_rows(self.m, self.cost_sample,
+                                np.random.RandomState(self.random_state))
+        batch_size = min(self.batch_size or 1, self.m)
+        rng = np.random.RandomState(self.random_state)
+        indices = np.arange(self.m)
 
         for i in range(self.max_iter):
+            record = i % self.cost_every == 0
             if self.batch:
-                if self.fit_intercept:
-                    preds = np.dot(X, self.coef_.T) + self.intercept_
-                    error = preds - y
-                    gradient = np.dot(X.T, error)
-                    if self.penalty:
-                        self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_) / self.m
-                    else:
-                        self.coef_ -= self.learning_rate * gradient.T / self.m
-                        self.intercept_ -= self.learning_rate * error.sum() / self.m
-                else:
-                    preds = np.dot(X, self.coef_.T)
-                    # print(preds.T)
-                    # print(np.isnan(preds).any(), i)
-                    error = preds - y
-                    gradient = np.dot(X.T, error)
-                    if self.penalty:
-                        self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_) / self.m
-                    else:
-                        # print(gradient.T.shape, gradient.T, error)
-                        self.coef_ -= self.learning_rate * gradient.T / self.m
-                train_mse = mse(y_pred=preds, y_true=y)
-                self.costs[i] = np.sqrt(train_mse)
+                error, grad_coef, grad_intercept = self._gradient(X, y)
+                if record:
+                    # the residuals of the gradient give the cost for free
+                    self.costs[len(cost_iters)] = self._rmse(error if rows is None else error[rows])
+                    cost_iters.append(i)
+                grad_mapping = self.penalty_.gradient_mapping(
+                    self.coef_, grad_coef, self.learning_rate, self.m)
+                converged = monitor.converged(
+                    grads=[grad_mapping, grad_intercept] if self.fit_intercept else [grad_mapping])
+                if not converged:
+                    self._step(grad_coef, grad_intercept)
             else:
-                for idx, x in enumerate(X):
-                    if self.fit_intercept:
-                        pred = np.dot(x, self.coef_.T) + self.intercept_
-                        error = pred - y[idx]
-                        gradient = x * error
-                        if self.penalty:
-                            self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_ / self.m)
-                        else:
-                            self.coef_ -= self.learning_rate * gradient.T
-                        self.intercept_ -= self.learning_rate * error
+                if batch_size == 1 and self.optimizer == 'sgd' and not sparse.issparse(X):
+                    if self.shuffle:
+                        rng.shuffle(indices)
+                    self._sgd_samples(X, y, indices if self.shuffle else range(self.m))
+                else:
+                    self._minibatch_epoch(X, y, batch_size, indices, rng)
+                converged = False
+                if record:
+                    if rows is None:
+                        error = self.predict(X) - y
                     else:
-                        pred = np.dot(x, self.coef_.T)
-                        error = pred - y[idx]
-                        gradient = x * error
-                        if self.penalty:
-                            self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_ / self.m)
-                        else:
-                            self.coef_ -= self.learning_rate * gradient.T
-                train_mse = mse(y_pred=self.predict(X), y_true=y)
-                self.costs[i] = np.sqrt(train_mse)
+                        error = self.predict(X[rows]) - y[rows]
+                    self.costs[len(cost_iters)] = self._rmse(error)
+                    cost_iters.append(i)
+                    converged = monitor.converged(cost=self.costs[len(cost_iters) - 1])
+            if converged:
+                break
+
+        self.n_iter_ = i + 1
+        self.cost_iters_ = np.array(cost_iters)
+        self.costs = self.costs[:len(cost_iters)]
         return self
 
+    def _gradient(self, X, y):
+        """
+        Gradient of the mean squared error / 2 on the rows X, with the
+        smooth part of the penalty scaled by the size of the data set.
+
+        Return:
+            error: (m, 1) residuals
+            grad_coef: (1, n_features)
+            grad_intercept: (1,)
+        """
+        error = self.predict(X) - y
+        grad_coef = np.dot(error.T, X) / X.shape[0]
+        grad_coef += self.penalty_.gradient(self.coef_, self.m)
+        return error, grad_coef, error.mean(axis=0)
+
+    def _minibatch_epoch(self, X, y, batch_size, indices, rng):
+        if self.shuffle:
+            # gathering the rows of a batch copies only the batch
+            batches = shuffled_batches(indices, batch_size, rng)
+        else:
+            # slices of X are views
+            batches = gen_batches(self.m, batch_size)
+        for batch in batches:
+            _, grad_coef, grad_intercept = self._gradient(X[batch], y[batch])
+            self._step(grad_coef, grad_intercept)
+
+    def _sgd_samples(self, X, y, order):
+        """
+        One epoch of plain sgd on one dense row at a time, in order. A
+        single row is too small for the vectorized _gradient and _step
+        to pay off, here every update is a dot product and an in-place
+        update of coef_.
+        """
+        coef = self.coef_[0]
+        intercept = self.intercept_[0]
+        learning_rate = self.learning_rate
+        decay = 1 - learning_rate * self.penalty_.l2 / self.m
+        for idx in order:
+            x = X[idx]
+            step = learning_rate * (np.dot(x, coef) + intercept - y[idx, 0])
+            if decay != 1:
+                coef *= decay
+            coef -= step * x
+            if self.fit_intercept:
+                intercept -= step
+            if self.penalty_.l1:
+                self.penalty_.prox(self.coef_, learning_rate, self.m)
+        self.intercept_[0] = intercept
+
+    @staticmethod
+    def _rmse(error):
+        return np.sqrt(np.mean(np.square(error)))
+
+    def _step(self, grad_coef, grad_intercept):
+        if self.fit_intercept:
+            self.optimizer_.update([self.coef_, self.intercept_],
+                                   [grad_coef.reshape(self.coef_.shape), grad_intercept])
+        else:
+            self.optimizer_.update([self.coef_], [grad_coef.reshape(self.coef_.shape)])
+        self.penalty_.prox(self.coef_, self.learning_rate, self.m)
+
     def predict(self, X):
         if self.fit_intercept:
-            return np.dot(X, self.coef_.T) + self.intercept_
-        return np.dot(X, self.coef_.T)
+            return linear_scores(X, self.coef_, self.intercept_)
+        return linear_scores(X, self.coef_, 0)
 
 
     def score(self, X, y):
         return r2_score(y_true=y.flatten(), y_pred = self.predict(X))
 
-class Ridge(BaseEstimator):
+def sgd_regression_path(X, y, c_lambdas, **params):
+    """
+    Fit an l2 penalized SGDRegressor for every value in c_lambdas, from
+    the strongest penalty to the weakest, each fit starting from the
+    previous solution. Pass a tol so the warm started fits can stop early.
+
+    Return:
+        c_lambdas: (n_lambdas,) the penalties in the order they were fitted
+        coefs: (n_lambdas, n_features) coef_ of every fit
+        intercepts: (n_lambdas,) intercept_ of every fit
+        n_iters: (n_lambdas,) n_iter_ of every fit
+    """
+    params.setdefault('penalty', 'l2')
+    c_lambdas, coefs, intercepts, n_iters = regularization_path(
+        SGDRegressor(**params), X, y, c_lambdas)
+    return c_lambdas, coefs[:, 0], intercepts[:, 0], n_iters
+
+
+class Ridge(LinearRegression):
     """
     Note:
         No equivalent Normal Equation solver in sklearn Ridge implementation
+
+    Parameters
+    ----------
+    alpha : float, default 1.0
+        Weight of the squared norm of coef_, the intercept is not
+        penalized.
+    solver : {'auto', 'cholesky', 'qr', 'lstsq', 'svd', 'cg', 'lsqr', 'lsmr'}, default 'auto'
+        See LinearRegression.
+    n_jobs : int, default None
+        See LinearRegression.
+    tol : float, default 1e-6
+        Tolerance of the iterative solvers.
+    max_iter : int, default None
+        Iteration cap of the iterative solvers.
     """
-    def __init__(self, fit_intercept=True, alpha=1.0):
+    def __init__(self, fit_intercept=True, alpha=1.0, solver='auto', n_jobs=None,
+                 tol=1e-6, max_iter=None):
         self.weights = None
         self.fit_intercept = fit_intercept
-        self.c_lambda = alpha
+        self.alpha = alpha
+        self.solver = solver
+        self.n_jobs = n_jobs
+        self.tol = tol
+        self.max_iter = max_iter
 
-    def _fit_intercept(self, X):
-        intercept = np.ones((X.shape[0], 1))
-        return np.hstack((intercept, X))
+    def _alpha(self):
+        return self.alpha
+
+
+class RidgeCV(LinearModelMixin, BaseEstimator):
+    """
+    Ridge with alpha chosen among alphas by leave-one-out or generalized
+    cross-validation, all from one SVD of the centered X.
+
+    With X = U S V.T the fitted values of alpha are U diag(f) U.T y and
+    the leave-one-out residuals (y - fitted) / (1 - h), with
+    f = s^2 / (s^2 + alpha) and h the diagonal of the hat matrix,
+    (U * U) f. Every alpha then costs O(m * rank) per target instead of
+    a new fit per alpha and left out sample. The unpenalized intercept
+    adds 1 / m to h, since the centered X is orthogonal to it.
+
+    Parameters
+    ----------
+    alphas : array-like, default (0.1, 1.0, 10.0)
+    cv : {'loo', 'gcv'}, default 'loo'
+        'loo' is the exact leave-one-out mean squared error, 'gcv' its
+        generalized cross-validation approximation, which replaces
+        every h by the mean of h.
+    alpha_per_target : bool, default False
+        Choose an alpha for every column of a 2d y instead of the one
+        with the lowest error summed over all of them.
+
+    Attributes
+    ----------
+    alpha_ : float, or array of shape (n_targets,) with alpha_per_target
+    cv_errors_ : array, shape (n_alphas, n_targets)
+        Cross-validation mean squared error of every alpha and target.
+    """
+    def __init__(self, alphas=(0.1, 1.0, 10.0), fit_intercept=True, cv='loo',
+                 alpha_per_target=False):
+        self.alphas = alphas
+        self.fit_intercept = fit_intercept
+        self.cv = cv
+        self.alpha_per_target = alpha_per_target
 
     def fit(self, X, y):
+        """
+        Args:
+            X: (m, n) numpy array
+            y: (m,) or (m, n_targets)
+        Return:
+            self
+        """
+        if self.cv not in ('loo', 'gcv'):
+            raise ValueError("cv should be 'loo' or 'gcv', got %r" % self.cv)
+        alphas = np.asarray(self.alphas, dtype=float).ravel()
+        if alphas.size == 0 or np.any(alphas < 0):
+            raise ValueError("alphas should be non-negative, got %r" % (self.alphas,))
+
+        X = np.asarray(X, dtype=float)
+        Y = np.asarray(y, dtype=float).reshape(X.shape[0], -1)
+        m, n_features = X.shape
+        x_mean, y_mean = np.zeros(n_features), np.zeros(Y.shape[1])
         if self.fit_intercept:
-            X = self._fit_intercept(X)
-        self.m, self.n = X.shape
-        
-        L = np.eye(self.n)
-        L[0,0] = 0
-        self.c_lambda *= L
-        self.weights = np.linalg.inv(X.T.dot(X) + self.c_lambda).dot(X.T).dot(y)
+            x_mean, y_mean = X.mean(axis=0), Y.mean(axis=0)
+            X, Y = X - x_mean, Y - y_mean
+
+        U, s, Vt = np.linalg.svd(X, full_matrices=False)
+        keep = s > s[0] * max(X.shape) * np.finfo(float).eps
+        U, s, Vt = U[:, keep], s[keep], Vt[keep]
+        UtY = np.dot(U.T, Y)
+        U2 = np.square(U)
+        s2 = np.square(s)
+        intercept_leverage = 1. / m if self.fit_intercept else 0.
+
+        self.cv_errors_ = np.empty((alphas.shape[0], Y.shape[1]))
+        for i, alpha in enumerate(alphas):
+            shrink = s2 / (s2 + alpha)
+            residual = Y - np.dot(U, shrink[:, np.newaxis] * UtY)
+            if self.cv == 'loo':
+                h = np.dot(U2, shrink) + intercept_leverage
+                self.cv_errors_[i] = np.mean(np.square(residual / (1 - h)[:, np.newaxis]), axis=0)
+            else:
+                dof = shrink.sum() + intercept_leverage * m
+                self.cv_errors_[i] = np.mean(np.square(residual), axis=0) / (1 - dof / m) ** 2
+
+        if self.alpha_per_target:
+            self.alpha_ = alphas[self.cv_errors_.argmin(axis=0)]
+            alpha = self.alpha_
+        else:
+            self.alpha_ = alphas[self.cv_errors_.sum(axis=1).argmin()]
+            alpha = np.full(Y.shape[1], self.alpha_)
+
+        coef = np.dot(Vt.T, s[:, np.newaxis] / (s2[:, np.newaxis] + alpha) * UtY)
+        if self.fit_intercept:
+            coef = np.vstack((y_mean - np.dot(x_mean, coef), coef))
+        self.m, self.n = m, coef.shape[0]
+        self.weights = coef[:, 0] if np.ndim(y) == 1 else coef
+        if np.ndim(y) == 1 and self.alpha_per_target:
+            self.alpha_ = self.alpha_[0]
         return self
 
-    @property
-    def coef_(self):
-        if self.n == 1:
-            return self.weights[1:]
-        return self.weights[1:]
 
-    def predict(self, X):
+class RecursiveLeastSquares(LinearRegression):
+    """
+    Least squares updated online: partial_fit refreshes weights after
+    every batch from the inverse Gram matrix P = (X.T X)^-1 instead of
+    refitting. A batch of b rows is applied with the Woodbury identity,
+
+        K = P X.T (forgetting_factor I + X P X.T)^-1
+        w <- w + K (y - X w)
+        P <- (P - K X P) / forgetting_factor
+
+    which costs O(n^2 b + b^3), O(n^2) per row, Sherman-Morrison when
+    b = 1. After T batches the weights minimize
+
+        sum_t forgetting_factor^(T - t) |y_t - X_t w|^2
+            + forgetting_factor^T alpha |w|^2
+
+    so a forgetting_factor below 1 tracks a drifting target, the weight
+    of a batch halving every log(0.5) / log(forgetting_factor) batches.
+
+    Parameters
+    ----------
+    alpha : float, default 1e-6
+        Initial ridge penalty, P starts as I / alpha. It also applies to
+        the intercept, which is fitted as a column of ones.
+    forgetting_factor : float, default 1.0
+        Discount of the past at every batch, in (0, 1].
+
+    Attributes
+    ----------
+    inv_gram_ : array, shape (n, n)
+        P, with the intercept first.
+    """
+    def __init__(self, fit_intercept=True, alpha=1e-6, forgetting_factor=1.0):
+        self.fit_intercept = fit_intercept
+        self.alpha = alpha
+        self.forgetting_factor = forgetting_factor
+
+    def fit(self, X, y):
+        """
+        Reset the model and apply X, y as a single batch.
+
+        Return:
+            self
+        """
+        if hasattr(self, 'inv_gram_'):
+            del self.inv_gram_
+        return self.partial_fit(X, y)
+
+    def partial_fit(self, X, y):
+        """
+        Update the weights with a batch of rows.
+
+        Args:
+            X: (b, n_features)
+            y: (b,) or (b, k)
+        Return:
+            self
+        """
+        if not 0 < self.forgetting_factor <= 1:
+            raise ValueError("forgetting_factor should be in (0, 1], got %r"
+                             % self.forgetting_factor)
         if self.fit_intercept:
             X = self._fit_intercept(X)
-        return np.dot(X, self.weights)
+        Y = np.asarray(y, dtype=np.float64).reshape((X.shape[0], -1))
+        if not hasattr(self, 'inv_gram_'):
+            self.m, self.n = 0, X.shape[1]
+            self.inv_gram_ = np.eye(self.n) / self.alpha
+            self._coef = np.zeros((self.n, Y.shape[1]))
+
+        lam = self.forgetting_factor
+        PXt = np.dot(self.inv_gram_, X.T)
+        innovation = np.dot(X, PXt)
+        innovation.flat[::X.shape[0] + 1] += lam
+        gain = cho_solve(cho_factor(innovation), PXt.T).T
+        self._coef += np.dot(gain, Y - np.dot(X, self._coef))
+        P = (self.inv_gram_ - np.dot(gain, PXt.T)) / lam
+        # keep P symmetric against rounding
+        self.inv_gram_ = (P + P.T) / 2
+
+        self.m += X.shape[0]
+        self.weights = self._coef[:, 0] if np.ndim(y) == 1 else self._coef.copy()
+        return self
+
+    def finalize(self):
+        """the weights are always up to date"""
+        return self
 
 
 if __name__ == '__main__':
@@ -2,16 +2,115 @@
 Logistic Regression
 """
 import numpy as np
-import math, inspect
+import math, inspect, os
+from time import perf_counter
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from sklearn.metrics import accuracy_score
 from sklearn.base import BaseEstimator
 from scipy.special import expit as sigmoid
-from sklearn.preprocessing import LabelEncoder
+from scipy.special import softmax
+from scipy.optimize import minimize
+from scipy.sparse import issparse
+from sklearn.preprocessing import LabelEncoder, LabelBinarizer
+from sklearn.utils.extmath import safe_sparse_dot
 
+from .base import (LinearScoresMixin, SparseCoefMixin, attach_shared_array, linear_scores,
+                   regularization_path, shared_array, shuffled_batches)
+from .optim import ConvergenceMonitor, Penalty, cost_sample_rows, get_optimizer
 
-class LogisticRegression(BaseEstimator):
+
+def _fit_ovr_block(params, X_handle, Y, coef, intercept):
+    """
+    Worker of LogisticRegression's parallel one-vs-rest fit, trains the
+    classes in the columns of Y starting from coef and intercept.
+    """
+    X, shm = attach_shared_array(X_handle)
+    try:
+        clf = LogisticRegression(**params)
+        clf.m = X.shape[0]
+        clf.coef_, clf.intercept_ = coef, intercept
+        clf._reset_solver()
+        clf._solve(X, Y)
+        return clf.coef_, clf.intercept_, clf.costs, clf.n_iter_, clf.cost_iters_
+    finally:
+        del X
+        shm.close()
+
+
+class LogisticRegression(SparseCoefMixin, BaseEstimator):
     """
+    X can be a scipy.sparse matrix in fit, decision_function and
+    predict_proba, it is never densified.
+
+    Parameters
+    ----------
+    penalty : {None, 'l2', 'l1', 'elasticnet'}, default None
+        Penalty on coef_ of strength c_lambda, see learn.optim.Penalty.
+        The l1 part is applied as a proximal (soft-thresholding) step
+        after every update of the 'gd' solver, which makes coef_ sparse,
+        see sparsify. It is exact for optimizer='sgd'. The 'newton' and
+        'lbfgs' solvers only support 'l2'.
+    l1_ratio : float, default 0.15
+        Share of the l1 part of the 'elasticnet' penalty.
+    sgd : bool, default False
+        Update the weights on mini-batches instead of the full data set.
+    batch_size : int, default None
+        Number of samples in each mini-batch when sgd is True.
+        None or 1 updates on one sample at a time.
+    multi_class : {'ovr', 'multinomial'}, default 'ovr'
+        'ovr' fits one sigmoid per class, 'multinomial' minimizes the
+        softmax cross-entropy of all classes jointly. Binary problems
+        always use a single sigmoid.
+    solver : {'gd', 'newton', 'lbfgs'}, default 'gd'
+        'gd' is gradient descent with a fixed learning_rate, 'newton' is
+        Newton's method (IRLS), which solves a (n_features + 1) square
+        system per class and iteration so it suits low-dimensional data,
+        'lbfgs' is scipy's L-BFGS-B. Only loss='log' supports the
+        'newton' and 'lbfgs' solvers.
+    tol : float or None, default None
+        Full-batch solvers stop once the largest absolute entry of the
+        gradient falls below tol, sgd stops once the cost has not improved
+        by tol for n_iter_no_change epochs. None always runs max_iter
+        iterations, so set it, e.g. 1e-4, with 'newton' and 'lbfgs'.
+    n_iter_no_change : int, default 5
+        Number of epochs without improvement before sgd stops.
+    lr_schedule : {'constant', 'invscaling'}, default 'constant'
+        'invscaling' decays the step size of the t-th update to
+        learning_rate / t ** power_t. The update count carries over
+        between partial_fit calls.
+    power_t : float, default 0.5
+    optimizer : {'sgd', 'momentum', 'nesterov', 'adagrad', 'rmsprop', 'adam'}, default 'sgd'
+        Update rule of the 'gd' solver and partial_fit, see learn.optim.
+    momentum : float, default 0.9
+        Used by the 'momentum' and 'nesterov' optimizers.
+    warm_start : bool, default False
+        Start fit from the coef_ and intercept_ of the previous fit when
+        the classes and features match, see logistic_regression_path.
+    n_jobs : int, default None
+        Number of processes that train the one-vs-rest classes of a dense
+        multiclass problem, every process gets a share of the classes and
+        reads X from shared memory. None or 1 trains in this process,
+        -1 uses all CPUs. With tol, every share of the classes stops on
+        its own and n_iter_ is the largest of their iterations.
+        loss='perceptron' always trains in this process.
+    cost_every : int, default 1
+        The 'gd' solver and partial_fit only record the cost every
+        cost_every iterations. sgd has to predict the whole data set to
+        get a cost, so this saves a pass over X per skipped epoch. The
+        n_iter_no_change of sgd counts recorded costs.
+    cost_sample : int, float or None, default None
+        Evaluate the recorded costs on a fixed random subsample of this
+        many rows, or of this fraction of the rows, instead of all of
+        them. Drawn with random_state, independently of the shuffling.
+    average : bool, default True
+        With loss='perceptron', end with the average of the weights over
+        all the updates, which is much more stable than the last ones on
+        data that is not separable. The perceptron is trained one-vs-rest
+        from the mistakes alone, learning_rate, batch_size, sgd, tol and
+        n_iter_no_change apply to it, its costs are the fraction of rows
+        misclassified during each epoch.
+
     Attributes
     ----------
     coef_ : array, shape (1, n_features) if n_classes == 2 
@@ -19,6 +118,19 @@ class LogisticRegression(BaseEstimator):
         Weights assigned to the features.
     intercept_ : array, shape (1,) if n_classes == 2 else (n_classes,)
         Constants in decision function.
+    n_iter_ : int
+        Number of iterations run by the solver. partial_fit counts one
+        iteration per call.
+    costs : array, shape (n_costs,) or (n_classes, n_costs)
+        Cost of every recorded iteration, per class for one-vs-rest.
+    cost_iters_ : array, shape (n_costs,)
+        Iteration of every entry of costs, counted from 0.
+    t_ : int
+        Number of weight updates made so far, plus one.
+    n_samples_seen_ : int
+        Rows seen by fit and the partial_fit calls after it.
+    fit_time_ : float
+        Wall-clock seconds spent in the solver.
     """
     def __init__(self, 
                     fit_intercept = True,
@@ -29,7 +141,22 @@ class LogisticRegression(BaseEstimator):
                     sgd = False,
                     penalty = None,
                     c_lambda = 0,
-                    random_state = None):
+                    random_state = None,
+                    batch_size = None,
+                    multi_class = 'ovr',
+                    solver = 'gd',
+                    tol = None,
+                    n_iter_no_change = 5,
+                    lr_schedule = 'constant',
+                    power_t = 0.5,
+                    warm_start = False,
+                    optimizer = 'sgd',
+                    momentum = 0.9,
+                    n_jobs = None,
+                    cost_every = 1,
+                    cost_sample = None,
+                    average = True,
+                    l1_ratio = 0.15):
         self.fit_intercept = fit_intercept
         self.max_iter = int(max_iter)
         self.learning_rate = learning_rate
@@ -39,6 +166,21 @@ class LogisticRegression(BaseEstimator):
         self.penalty = penalty
         self.loss = loss
         self.random_state = random_state
+        self.batch_size = batch_size
+        self.multi_class = multi_class
+        self.solver = solver
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.lr_schedule = lr_schedule
+        self.power_t = power_t
+        self.warm_start = warm_start
+        self.optimizer = optimizer
+        self.momentum = momentum
+        self.n_jobs = n_jobs
+        self.cost_every = cost_every
+        self.cost_sample = cost_sample
+        self.average = average
+        self.l1_ratio = l1_ratio
         self.update_loss_func()
 
     def update_loss_func(self):
@@ -47,132 +189,622 @@ class LogisticRegression(BaseEstimator):
         elif self.loss == 'log':
             self.loss_function_ = self.log_decision_func
 
-    def log_likelihood(self, preds, target, i=None):
-        ll = - (np.dot(target.T,  np.log(preds + np.finfo(float).eps)) + 
-                np.dot((1 - target).T, np.log(1 - preds + np.finfo(float).eps))) / self.m
-        if self.penalty:
-            if len(self.classes_) == 2:
-                ll += self.c_lambda * np.square(self.coef_).sum() / (2 * self.m)
-            else:
-                ll += self.c_lambda * np.square(self.coef_[i]).sum() / (2 * self.m)
-        return ll
+    def log_likelihood(self, preds, target):
+        """
+        Args:
+            preds: (m, n_classes) predicted probabilities
+            target: (m, n_classes) one-hot targets
+        Return:
+            The mean cross-entropy over the m rows, plus the penalty
+            scaled by the size of the training set.
+
+            ll: (n_classes,) cost of every one-vs-rest problem,
+                (1,) cross-entropy if multinomial
+        """
+        if self._is_multinomial():
+            ll = - np.atleast_1d((target * np.log(preds + np.finfo(float).eps)).sum()) / target.shape[0]
+            return ll + self.penalty_.cost(self.coef_, self.m).sum()
+
+        ll = - (target * np.log(preds + np.finfo(float).eps) + 
+                (1 - target) * np.log(1 - preds + np.finfo(float).eps)).sum(axis=0) / target.shape[0]
+        return ll + self.penalty_.cost(self.coef_, self.m)
 
     def perceptron_decision_fuc(self, X):
-        pred = np.dot(X, self.coef_.T) + self.intercept_
+        pred = linear_scores(X, self.coef_, self.intercept_)
         return np.where(pred >= 0, 1, 0)
 
     def log_decision_func(self, X):
-        pred = sigmoid(np.dot(X, self.coef_.T) + self.intercept_)
-        return pred
+        scores = linear_scores(X, self.coef_, self.intercept_)
+        if self._is_multinomial():
+            return softmax(scores, axis=-1)
+        return sigmoid(scores)
+
+    def _is_multinomial(self):
+        return self.multi_class == 'multinomial' and self.coef_.shape[0] > 1
+
+    def _gradient(self, X, Y, penalty=True):
+        """
+        Gradient of the cost on the rows X with one-hot targets Y.
+
+        The penalty is scaled by the size of the whole data set, so a
+        mini-batch of all the rows gives the full gradient. Only the
+        smooth part of the penalty is included, and only with penalty,
+        _step applies the rest.
+
+        Return:
+            preds: (m, n_classes) predictions on X
+            grad_coef: (n_classes, n_features)
+            grad_intercept: (n_classes,)
+        """
+        preds = self.loss_function_(X)
+        error = preds - Y
+        grad_coef = safe_sparse_dot(error.T, X) / X.shape[0]
+        if penalty:
+            grad_coef += self.penalty_.gradient(self.coef_, self.m)
+        return preds, grad_coef, error.mean(axis=0)
+
+    def _learning_rate(self):
+        if self.lr_schedule == 'invscaling':
+            return self.learning_rate / self.t_ ** self.power_t
+        return self.learning_rate
+
+    def _step(self, grad_coef, grad_intercept):
+        """one optimizer update of coef_ and intercept_"""
+        self.optimizer_.learning_rate = self._learning_rate()
+        if self.fit_intercept:
+            self.optimizer_.update([self.coef_, self.intercept_],
+                                   [grad_coef, grad_intercept])
+        else:
+            self.optimizer_.update([self.coef_], [grad_coef])
+        self.penalty_.prox(self.coef_, self.optimizer_.learning_rate, self.m)
+        self.t_ += 1
+
+    def _sgd_epoch(self, X, Y, indices, batch_size, rng):
+        if batch_size == 1 and self.optimizer == 'sgd' and not issparse(X):
+            rng.shuffle(indices)
+            return self._sgd_samples(X, Y, indices)
+        for rows in shuffled_batches(indices, batch_size, rng):
+            _, grad_coef, grad_intercept = self._gradient(X[rows], Y[rows])
+            self._step(grad_coef, grad_intercept)
+
+    def _sgd_samples(self, X, Y, order):
+        """
+        One epoch of plain sgd on one dense row at a time, in order. A
+        single row is too small for the vectorized _gradient and _step
+        to pay off, here every update is one prediction and an in-place
+        update of coef_ and intercept_.
+        """
+        for idx in order:
+            x = X[idx]
+            learning_rate = self._learning_rate()
+            step = learning_rate * (self.loss_function_(x) - Y[idx])
+            if self.penalty_.l2:
+                self.coef_ *= 1 - learning_rate * self.penalty_.l2 / self.m
+            self.coef_ -= np.outer(step, x)
+            if self.fit_intercept:
+                self.intercept_ -= step
+            self.penalty_.prox(self.coef_, learning_rate, self.m)
+            self.t_ += 1
+
+    def _cost(self, X, Y, rows, preds=None):
+        """
+        Cost on the subsample rows, or on all of X when rows is None.
+        preds of all the rows, when the gradient already computed them,
+        are reused instead of predicting again.
+        """
+        if preds is None:
+            preds = self.log_decision_func(X if rows is None else X[rows])
+        elif rows is not None:
+            preds = preds[rows]
+        if rows is not None:
+            Y = Y[rows]
+        return self.log_likelihood(preds = preds, target = Y)
+
+    def _get_theta(self):
+        """coef_ and intercept_ stacked as (n_classes, n_features + 1)"""
+        if self.fit_intercept:
+            return np.hstack((self.coef_, self.intercept_[:, np.newaxis]))
+        return self.coef_.copy()
 
-    def fit_binary(self, X, y):
-        self.le = LabelEncoder()
-        y = self.le.fit_transform(y)
-        self.classes_ = self.le.classes_
-        y.shape = (self.m, 1)
+    def _set_theta(self, theta):
+        if self.fit_intercept:
+            self.coef_ = theta[:, :-1].copy()
+            self.intercept_ = theta[:, -1].copy()
+        else:
+            self.coef_ = theta.copy()
+
+    def _weighted_gram(self, X, weights):
+        """
+        Z.T diag(weights) Z / m where Z is X with a column of ones
+        appended if fit_intercept, without building Z.
+        """
+        if issparse(X):
+            XtD = X.multiply(weights[:, np.newaxis]).T.tocsr()
+            gram = safe_sparse_dot(XtD, X, dense_output=True)
+        else:
+            XtD = (X * weights[:, np.newaxis]).T
+            gram = np.dot(XtD, X)
+        if self.fit_intercept:
+            Xtd = np.asarray(XtD.sum(axis=1)).ravel()
+            gram = np.block([[gram, Xtd[:, np.newaxis]],
+                             [Xtd[np.newaxis, :], weights.sum()]])
+        return gram / self.m
+
+    def _hessian(self, X, preds):
+        """
+        Return:
+            (n_classes, d, d) Hessian of every one-vs-rest problem, or the
+            (n_classes * d, n_classes * d) Hessian of the multinomial cost
+        """
+        n_classes = preds.shape[1]
+        d = X.shape[1] + int(self.fit_intercept)
+        ridge = np.zeros(d)
+        if self.penalty == 'l2':
+            ridge[:X.shape[1]] = self.c_lambda / self.m
+
+        if not self._is_multinomial():
+            hessian = np.empty((n_classes, d, d))
+            for k in range(n_classes):
+                hessian[k] = self._weighted_gram(X, preds[:, k] * (1 - preds[:, k]))
+                hessian[k].flat[::d + 1] += ridge
+            return hessian
+
+        hessian = np.empty((n_classes, d, n_classes, d))
+        for j in range(n_classes):
+            for k in range(j, n_classes):
+                weights = preds[:, j] * ((j == k) - preds[:, k])
+                hessian[j, :, k] = self._weighted_gram(X, weights)
+                hessian[k, :, j] = hessian[j, :, k].T
+            hessian[j, :, j].flat[::d + 1] += ridge
+        return hessian.reshape(n_classes * d, n_classes * d)
+
+    def _fit_newton(self, X, Y):
+        costs = self.costs.reshape(-1, self.max_iter)
+        monitor = ConvergenceMonitor(self.tol)
+
+        for step in range(self.max_iter):
+            preds, grad_coef, grad_intercept = self._gradient(X, Y)
+            costs[:, step] = self.log_likelihood(preds = preds, target = Y)
+            grad = np.hstack((grad_coef, grad_intercept[:, np.newaxis])) \
+                if self.fit_intercept else grad_coef
+            if monitor.converged(grads=[grad]):
+                break
+
+            hessian = self._hessian(X, preds)
+            if self._is_multinomial():
+                # the softmax is invariant to adding the same vector to
+                # every class, so this Hessian is singular without penalty
+                newton_step = np.linalg.lstsq(hessian, grad.ravel(), rcond=None)[0]
+            else:
+                try:
+                    newton_step = np.linalg.solve(hessian, grad[..., np.newaxis])
+                except np.linalg.LinAlgError:
+                    newton_step = np.matmul(np.linalg.pinv(hessian), grad[..., np.newaxis])
+            self._set_theta(self._get_theta() - newton_step.reshape(grad.shape))
+
+        self.n_iter_ = step + 1
+        self.cost_iters_ = np.arange(self.n_iter_)
+        return self
 
-        if self.random_state is not None:
-            np.random.seed(self.random_state)
+    def _fit_lbfgs(self, X, Y):
+        shape = self._get_theta().shape
+        iteration_costs = []
+        last_cost = []
+
+        def fun(theta):
+            self._set_theta(theta.reshape(shape))
+            preds, grad_coef, grad_intercept = self._gradient(X, Y)
+            cost = self.log_likelihood(preds = preds, target = Y)
+            last_cost[:] = [cost]
+            grad = np.hstack((grad_coef, grad_intercept[:, np.newaxis])) \
+                if self.fit_intercept else grad_coef
+            # one-vs-rest problems are independent, so minimizing their
+            # sum solves every one of them
+            return cost.sum(), grad.ravel()
+
+        def callback(theta):
+            iteration_costs.append(last_cost[0])
+
+        res = minimize(fun, self._get_theta().ravel(), jac=True,
+                       method='L-BFGS-B', callback=callback,
+                       options={'maxiter': self.max_iter, 'gtol': self.tol or 0})
+        self._set_theta(res.x.reshape(shape))
+        self.n_iter_ = res.nit
+        if iteration_costs:
+            self.costs = np.array(iteration_costs).T.reshape(
+                self.costs.shape[:-1] + (len(iteration_costs),))
+        self.cost_iters_ = np.arange(len(iteration_costs))
+        return self
 
+    def _fit_gd(self, X, Y):
+        """
+        Train on the one-hot targets Y with gradient descent.
+
+        Column i of Y is the binary target of class i, so every iteration
+        updates the whole (n_classes, n_features) coef_ with one product
+        against X instead of looping over the classes. Both the one-vs-rest
+        sigmoids and the multinomial softmax have the gradient
+        (preds - Y).T X, they only differ in how preds are computed.
+
+        Full-batch costs reuse the predictions of the gradient, sgd costs
+        need a prediction pass of their own, over the cost_sample rows,
+        every cost_every epochs.
+        """
+        costs = self.costs.reshape(-1, self.max_iter)
+        cost_iters = []
+        batch_size = min(self.batch_size or 1, self.m)
+
+        # a mini-batch as large as the data set is plain gradient descent,
+        # where the order of the rows does not matter
+        sgd = self.sgd and batch_size < self.m
+        rng = np.random.RandomState(self.random_state)
+        indices = np.arange(self.m)
+        monitor = ConvergenceMonitor(self.tol, self.n_iter_no_change)
+        rows = cost_sample_rows(self.m, self.cost_sample,
+                                np.random.RandomState(self.random_state))
 
         for step in range(self.max_iter):
-            indices = np.arange(self.m)
-            np.random.shuffle(indices)
-            X = X[indices]
-            y = y[indices]
-            if self.sgd:
-                for idx, x in enumerate(X):
-                    pred = self.loss_function_(x)
-                    error = pred - y[idx]
-                    gradient = x * error
-                    if self.penalty == 'l2':
-                        self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_ / self.m)
-                    else:
-                        self.coef_ -= self.learning_rate * gradient.T
-                    self.intercept_ -= self.learning_rate * error
-
-                preds = sigmoid(np.dot(X, self.coef_.T) + self.intercept_)
-                cost = self.log_likelihood(preds = preds, target = y)
+            record = step % self.cost_every == 0
+            if record:
+                cost = costs[:, len(cost_iters)]
+                cost_iters.append(step)
+
+            if sgd:
+                self._sgd_epoch(X, Y, indices, batch_size, rng)
+                converged = False
+                if record:
+                    cost[:] = self._cost(X, Y, rows)
+                    converged = monitor.converged(cost=cost.sum())
 
             else:
-                preds = self.loss_function_(X)
-                error = preds - y
-                gradient = np.dot(X.T, error)
-                if self.penalty == 'l2':
-                    self.coef_ -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_) / self.m
-                else:
-                    self.coef_ -= self.learning_rate * gradient.T / self.m
-                self.intercept_ -= self.learning_rate * error.sum() / self.m
-                
-                cost = self.log_likelihood(preds = preds, target = y)
+                preds, grad_coef, grad_intercept = self._gradient(X, Y)
+                if record:
+                    cost[:] = self._cost(X, Y, rows, preds)
+                grad_mapping = self.penalty_.gradient_mapping(
+                    self.coef_, grad_coef, self._learning_rate(), self.m)
+                converged = monitor.converged(
+                    grads=[grad_mapping, grad_intercept] if self.fit_intercept else [grad_mapping])
+                if not converged:
+                    self._step(grad_coef, grad_intercept)
+
+            if converged:
+                break
+
+        self.n_iter_ = step + 1
+        self.cost_iters_ = np.array(cost_iters)
+        return self
 
-            self.costs[step] = cost
+    def _perceptron_update(self, X, S, wrong, c):
+        """
+        Add the mistakes wrong (m, n_classes) made on the rows X with
+        signed targets S to coef_ and intercept_, and c times them to
+        the sums _u_coef and _u_intercept used for the lazy average.
+        """
+        hit = wrong.any(axis=1)
+        if not hit.all():
+            X, S, wrong = X[hit], S[hit], wrong[hit]
+        delta = self.learning_rate * wrong * S
+        delta_coef = safe_sparse_dot(delta.T, X)
+        self.coef_ += delta_coef
+        self._u_coef += c * delta_coef
+        if self.fit_intercept:
+            delta_intercept = delta.sum(axis=0)
+            self.intercept_ += delta_intercept
+            self._u_intercept += c * delta_intercept
+
+    def _perceptron_mistakes(self, X, S):
+        return S * (safe_sparse_dot(X, self.coef_.T) + self.intercept_) <= 0
+
+    def _perceptron_online_epoch(self, X, S, indices, c):
+        """
+        One pass of the classic perceptron, updating after every mistake,
+        in the order of indices.
+
+        Rows are scored in windows against the current weights. The rows
+        before the first mistake of a window are correct under the same
+        weights the sequential algorithm would use, so only the mistake
+        triggers an update and a new window. Windows grow while no
+        mistakes are found, so near-separable data is scored in large
+        vectorized blocks.
+
+        Return:
+            wrong: (n_classes,) mistakes made during the pass
+            c: the update counter after the pass
+        """
+        m = indices.shape[0]
+        wrong = np.zeros(S.shape[1])
+        start, size = 0, 1
+        while start < m:
+            rows = indices[start:start + size]
+            mistakes = self._perceptron_mistakes(X[rows], S[rows])
+            hit = mistakes.any(axis=1)
+            if not hit.any():
+                c += rows.shape[0]
+                start += rows.shape[0]
+                size = min(2 * size, 1024)
+                continue
+
+            first = hit.argmax()
+            c += first
+            row = rows[first:first + 1]
+            self._perceptron_update(X[row], S[row], mistakes[first:first + 1], c)
+            wrong += mistakes[first]
+            c += 1
+            start += first + 1
+            size = max(2 * first, 1)
+        return wrong, c
+
+    def _fit_perceptron(self, X, Y):
+        """
+        Averaged perceptron, one-vs-rest on the one-hot targets Y.
+
+        Only misclassified rows change the weights. With sgd and a
+        batch_size of 1 this is the classic online perceptron, larger
+        batches and full-batch training add up the mistakes of a whole
+        block in one product. coef_ and intercept_ end as the average of
+        the weights after every update step when average is True, kept
+        lazily as coef_ - _u_coef / c so correct rows cost nothing.
+        costs holds the fraction of the rows each class got wrong during
+        every epoch.
+        """
+        costs = self.costs.reshape(-1, self.max_iter)
+        batch_size = min(self.batch_size or 1, self.m) if self.sgd else self.m
+        S = 2. * Y - 1
+        rng = np.random.RandomState(self.random_state)
+        indices = np.arange(self.m)
+        monitor = ConvergenceMonitor(self.tol, self.n_iter_no_change)
+
+        self._u_coef = np.zeros_like(self.coef_)
+        self._u_intercept = np.zeros_like(self.intercept_)
+        c = 1
+        for step in range(self.max_iter):
+            if batch_size == 1:
+                rng.shuffle(indices)
+                wrong, c = self._perceptron_online_epoch(X, S, indices, c)
+            elif batch_size == self.m:
+                # the order does not matter to a single block
+                wrong = self._perceptron_mistakes(X, S)
+                self._perceptron_update(X, S, wrong, c)
+                wrong = wrong.sum(axis=0)
+                c += 1
+            else:
+                wrong = np.zeros(S.shape[1])
+                for rows in shuffled_batches(indices, batch_size, rng):
+                    X_batch, S_batch = X[rows], S[rows]
+                    mistakes = self._perceptron_mistakes(X_batch, S_batch)
+                    self._perceptron_update(X_batch, S_batch, mistakes, c)
+                    wrong += mistakes.sum(axis=0)
+                    c += 1
+
+            costs[:, step] = wrong / self.m
+            if not wrong.any() or monitor.converged(cost=costs[:, step].sum()):
+                break
+
+        if self.average:
+            self.coef_ -= self._u_coef / c
+            self.intercept_ -= self._u_intercept / c
+        del self._u_coef, self._u_intercept
+        self.n_iter_ = step + 1
+        self.cost_iters_ = np.arange(self.n_iter_)
+        return self
 
+    def _solve(self, X, Y):
+        if self.solver not in ('gd', 'newton', 'lbfgs'):
+            raise ValueError("solver should be 'gd', 'newton' or 'lbfgs', "
+                             "got %r" % self.solver)
+        if self.solver != 'gd' and self.loss != 'log':
+            raise ValueError("solver %r only supports loss='log'" % self.solver)
+        if self.loss == 'perceptron' and self.multi_class != 'ovr':
+            raise ValueError("loss='perceptron' only supports multi_class='ovr'")
+        if self.solver != 'gd' and self.penalty in ('l1', 'elasticnet'):
+            raise ValueError("solver %r only supports penalty='l2'" % self.solver)
+
+        start = perf_counter()
+        if self.loss == 'perceptron':
+            self._fit_perceptron(X, Y)
+        else:
+            getattr(self, '_fit_' + self.solver)(X, Y)
+        self.fit_time_ = perf_counter() - start
+        self.costs = self.costs[..., :len(self.cost_iters_)]
         return self
 
-    def fit_multiclass(self, X, y):
+    def fit_binary(self, X, y):
         self.le = LabelEncoder()
         y = self.le.fit_transform(y)
         self.classes_ = self.le.classes_
+        Y = y.reshape((self.m, 1))
+        return self._solve(X, Y)
 
-        for i in range(len(self.classes_)):
-            y_i = np.apply_along_axis(lambda x: np.where(x == i, 1, 0), axis=0, arr=y)
-            
-            for step in range(self.max_iter):
-                if self.sgd:
-                    for idx, x in enumerate(X):
-                        pred = sigmoid(np.dot(x, self.coef_[i].T) + self.intercept_[i])
-                        error = pred - y_i[idx]
-                        gradient = x * error
-                        if self.penalty == 'l2':
-                            self.coef_[i] -= self.learning_rate * (gradient + self.c_lambda * self.coef_[i] / self.m)
-                        else:
-                            self.coef_[i] -= self.learning_rate * gradient
-                        self.intercept_[i] -= self.learning_rate * error
-                    preds = sigmoid(np.dot(X, self.coef_[i].T) + self.intercept_[i])
-                else:
-                    preds = sigmoid(np.dot(X, self.coef_[i].T) + self.intercept_[i])
-                    error = preds - y_i
-                    gradient = np.dot(X.T, error) 
-                    if self.penalty == 'l2':
-                        self.coef_[i] -= self.learning_rate * (gradient.T + self.c_lambda * self.coef_[i])/ self.m
-                    else:
-                        self.coef_[i] -= self.learning_rate * gradient.T / self.m
-                    self.intercept_[i] -= self.learning_rate * error.sum() / self.m
-
-                cost = self.log_likelihood(preds = preds, target = y_i, i=i)
-                self.costs[i][step] = cost
-
+    def fit_multiclass(self, X, y):
+        self.le = LabelBinarizer()
+        Y = self.le.fit_transform(y)
+        self.classes_ = self.le.classes_
+        n_jobs = os.cpu_count() if self.n_jobs == -1 else (self.n_jobs or 1)
+        # the averaged perceptron stops all the classes together, a
+        # group stopping on its own would end with a different average
+        if (n_jobs > 1 and self.multi_class == 'ovr' and not issparse(X)
+                and self.loss != 'perceptron'):
+            return self._fit_ovr_parallel(X, Y, min(n_jobs, Y.shape[1]))
+        return self._solve(X, Y)
+
+    def _fit_ovr_parallel(self, X, Y, n_jobs):
+        """
+        Split the one-vs-rest classes into n_jobs groups and train every
+        group in its own process. X is shared, only the columns of Y and
+        the weights of a group are sent to its worker.
+        """
+        start = perf_counter()
+        groups = np.array_split(np.arange(Y.shape[1]), n_jobs)
+        params = dict(self.get_params(), n_jobs=None)
+
+        with shared_array(X) as X_handle, ProcessPoolExecutor(n_jobs) as pool:
+            futures = [pool.submit(_fit_ovr_block, params, X_handle, Y[:, group],
+                                   self.coef_[group], self.intercept_[group])
+                       for group in groups]
+            results = [future.result() for future in futures]
+
+        # groups can converge after a different number of iterations,
+        # the costs of the ones that stopped early keep their last value
+        longest = max(results, key=lambda result: result[3])
+        self.n_iter_, self.cost_iters_ = longest[3], longest[4]
+        n_costs = len(self.cost_iters_)
+        self.costs = np.empty((Y.shape[1], n_costs))
+        for group, (coef, intercept, costs, _, _) in zip(groups, results):
+            self.coef_[group] = coef
+            self.intercept_[group] = intercept
+            costs = costs.reshape(len(group), -1)
+            self.costs[group] = np.pad(costs, ((0, 0), (0, n_costs - costs.shape[1])), mode='edge')
+        self.fit_time_ = perf_counter() - start
         return self
 
+    def _can_warm_start(self, classes, n_features):
+        return (self.warm_start and hasattr(self, 'coef_')
+                and self.coef_.shape[1] == n_features
+                and np.array_equal(self.classes_, classes))
+
+    def _init_weights(self, n_classes, n_features):
+        n_rows = 1 if n_classes == 2 else n_classes
+        self.coef_ = np.zeros(shape=(n_rows, n_features))
+        self.intercept_ = np.zeros(shape=(n_rows,))
+
+    def _reset_solver(self):
+        """fresh optimizer state, penalty and costs for a new fit"""
+        self.t_ = 1
+        self.optimizer_ = get_optimizer(self.optimizer, self.learning_rate, self.momentum)
+        self.penalty_ = Penalty(self.penalty, self.c_lambda, self.l1_ratio)
+        self.costs = self._empty_costs(self.max_iter)
+
+    def _empty_costs(self, n_iter):
+        """one cost per iteration, per class for one-vs-rest"""
+        if self.coef_.shape[0] == 1 or self.multi_class == 'multinomial':
+            return np.empty(n_iter)
+        return np.empty((self.coef_.shape[0], n_iter))
+
+    def _check_params(self):
+        if self.multi_class not in ('ovr', 'multinomial'):
+            raise ValueError("multi_class should be 'ovr' or 'multinomial', "
+                             "got %r" % self.multi_class)
+        if self.lr_schedule not in ('constant', 'invscaling'):
+            raise ValueError("lr_schedule should be 'constant' or 'invscaling', "
+                             "got %r" % self.lr_schedule)
+        if self.cost_every < 1:
+            raise ValueError("cost_every should be at least 1, "
+                             "got %r" % self.cost_every)
+
     def fit(self, X, y):
+        self._check_params()
+
+        classes = np.unique(y)
+        n_classes = len(classes)
 
-        n_classes = len(np.unique(y))
+        if issparse(X):
+            # row slicing for mini-batches needs CSR
+            X = X.tocsr()
 
         self.m, n_features = X.shape
-        
+        self.n_samples_seen_ = self.m
+        self.densify()
+        if not self._can_warm_start(classes, n_features):
+            self._init_weights(n_classes, n_features)
+        self._reset_solver()
+        # a later partial_fit starts a new stream from this fit
+        for attr in ('_rng', '_cost_rng'):
+            if hasattr(self, attr):
+                delattr(self, attr)
         
         if n_classes == 2:
-            self.coef_ = np.zeros(shape=(1, n_features))
-            self.costs = np.empty(self.max_iter)
-            if self.fit_intercept:
-                self.intercept_ = np.zeros(shape=(1,))
             return self.fit_binary(X, y)
         else:
-            self.coef_ = np.zeros(shape=(n_classes, n_features))
-            self.costs = np.empty((n_classes, self.max_iter))
-            if self.fit_intercept:
-                self.intercept_ = np.zeros(shape=(n_classes,))    
             return self.fit_multiclass(X, y)
-        
+
+    def partial_fit(self, X, y, classes=None):
+        """
+        Run one epoch of mini-batch SGD on the chunk X, y, starting from
+        the current coef_ and intercept_.
+
+        The model of a previous fit is continued as well. The penalty
+        of every update is scaled by n_samples_seen_, the number of rows
+        seen up to and including its mini-batch, counting the rows of a
+        previous fit, so its strength does not depend on how the stream
+        is split into chunks. Early on that is a strong penalty, so its
+        l2 part shrinks the weights by an exact implicit step instead of
+        a gradient step, which would overshoot and diverge.
+
+        Args:
+            X: (m, n_features) chunk of samples, dense or sparse
+            y: (m,) labels of the chunk
+            classes: all the labels that can appear, required on the
+                first call since a single chunk may not contain them all
+        Return:
+            self
+
+        To train out of core, call it on every chunk read from disk:
+
+            clf = LogisticRegression(batch_size=256, lr_schedule='invscaling')
+            for X_chunk, y_chunk in chunks:
+                clf.partial_fit(X_chunk, y_chunk, classes=[0, 1])
+        """
+        self._check_params()
+        if self.loss != 'log':
+            raise ValueError("partial_fit only supports loss='log'")
+
+        if issparse(X):
+            X = X.tocsr()
+
+        if not hasattr(self, 'coef_'):
+            if classes is None:
+                raise ValueError("classes must be passed on the first call "
+                                 "to partial_fit")
+            self.le = LabelBinarizer().fit(classes)
+            self.classes_ = self.le.classes_
+            self._init_weights(len(self.classes_), X.shape[1])
+            self._reset_solver()
+            self.n_samples_seen_ = 0
+        elif classes is not None and not np.array_equal(np.unique(classes), self.classes_):
+            raise ValueError("classes %r differ from the classes %r seen "
+                             "before" % (classes, self.classes_))
+
+        if not hasattr(self, '_rng'):
+            # first call since the weights were created or fitted, the
+            # stream keeps its own shuffling and cost bookkeeping
+            self.costs = self._empty_costs(0)
+            self.cost_iters_ = np.empty(0, dtype=int)
+            self.n_iter_ = 0
+            self._rng = np.random.RandomState(self.random_state)
+            self._cost_rng = np.random.RandomState(self.random_state)
+
+        self.densify()
+        # binary labels of fit come from a LabelEncoder, one column
+        Y = self.le.transform(y).reshape((X.shape[0], -1))
+        batch_size = min(self.batch_size or 1, X.shape[0])
+        for rows in shuffled_batches(np.arange(X.shape[0]), batch_size, self._rng):
+            # the penalty is scaled by the rows seen up to this update,
+            # whatever the chunks they arrived in
+            self.n_samples_seen_ += rows.shape[0]
+            self.m = self.n_samples_seen_
+            _, grad_coef, grad_intercept = self._gradient(X[rows], Y[rows],
+                                                          penalty=False)
+            self._step(grad_coef, grad_intercept)
+            self.penalty_.shrink(self.coef_, self.optimizer_.learning_rate, self.m)
+
+        if self.n_iter_ % self.cost_every == 0:
+            rows = cost_sample_rows(X.shape[0], self.cost_sample, self._cost_rng)
+            cost = self._cost(X, Y, rows)
+            if self.costs.ndim == 1:
+                cost = cost.sum(keepdims=True)
+            else:
+                cost = cost[:, np.newaxis]
+            self.costs = np.concatenate((self.costs, cost), axis=-1)
+            self.cost_iters_ = np.append(self.cost_iters_, self.n_iter_)
+        self.n_iter_ += 1
+        return self
+
 
     def score(self, X, y):
         return accuracy_score(y, self.predict(X))
 
     def decision_function(self, X):
-        scores = np.dot(X, self.coef_.T) + self.intercept_
-        # print(scores)
-        scores = sigmoid(scores)
+        scores = self.log_decision_func(X)
         return scores.ravel() if scores.shape[1] == 1 else scores
 
     def predict_proba(self, X):
@@ -181,6 +813,9 @@ class LogisticRegression(BaseEstimator):
         if scores.ndim == 1:
             return np.vstack([1 - scores, scores]).T
 
+        if self._is_multinomial():
+            return scores
+
         # print(scores, scores.argmax(axis=1))
         scores /= scores.sum(axis=1).reshape((scores.shape[0], -1))
         # print(scores.sum(axis=1))
@@ -190,15 +825,40 @@ class LogisticRegression(BaseEstimator):
         if self.loss == 'log':
             scores = self.decision_function(X)
             if len(scores.shape) == 1:
-                indices = scores.round().astype(np.int)
+                indices = scores.round().astype(int)
             else:
                 indices = scores.argmax(axis=1)
         else:
             indices = self.loss_function_(X)
+            if indices.shape[1] == 1:
+                indices = indices[:, 0]
+            else:
+                indices = self.decision_function(X).argmax(axis=1)
         return self.classes_[indices]
 
 
-class LogisticRegression_v1(BaseEstimator):
+def logistic_regression_path(X, y, c_lambdas, **params):
+    """
+    Fit an l2 penalized LogisticRegression for every value in c_lambdas,
+    from the strongest penalty to the weakest. Each fit starts from the
+    previous solution, so it only needs a few iterations to converge.
+
+    Args:
+        X: (m, n_features) dense or sparse samples
+        y: (m,) labels
+        c_lambdas: penalty strengths
+        params: other LogisticRegression parameters
+    Return:
+        c_lambdas: (n_lambdas,) the penalties in the order they were fitted
+        coefs: (n_lambdas, n_rows, n_features) coef_ of every fit
+        intercepts: (n_lambdas, n_rows) intercept_ of every fit
+        n_iters: (n_lambdas,) n_iter_ of every fit
+    """
+    params.setdefault('penalty', 'l2')
+    return regularization_path(LogisticRegression(**params), X, y, c_lambdas)
+
+
+class LogisticRegression_v1(LinearScoresMixin, BaseEstimator):
     
     def __init__(self, num_iterations = 2000, 
                        learning_rate = 0.5, 
@@ -206,7 +866,11 @@ class LogisticRegression_v1(BaseEstimator):
                        print_cost = True,
                        steps = 10,
                        C = 0,
-                       penalty=None):
+                       penalty=None,
+                       tol=None,
+                       n_iter_no_change=5,
+                       optimizer='sgd',
+                       momentum=0.9):
         self.num_iterations = num_iterations
         self.learning_rate = learning_rate
         self.fit_intercept = fit_intercept
@@ -215,16 +879,16 @@ class LogisticRegression_v1(BaseEstimator):
         self.steps = steps
         self.penalty = penalty
         self.C = 1 / C if C != 0 else 0
-
-    def _fit_intercept(self, X):
-        intercept = np.ones((X.shape[0], 1))
-        return np.concatenate((intercept, X), axis=1)
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.optimizer = optimizer
+        self.momentum = momentum
 
     def log_likelihood(self, preds, target):
         ll = - (np.dot(target,  np.log(preds + np.finfo(float).eps)) + 
                 np.dot((1 - target), np.log(1 - preds + np.finfo(float).eps))) / self.m
         if self.penalty:
-            ll += self.C * np.square(self.weights[1:]).sum() / (2 * self.m)
+            ll += self.C * np.square(self.coef_).sum() / (2 * self.m)
         return ll
 
 
@@ -233,44 +897,50 @@ class LogisticRegression_v1(BaseEstimator):
         self.le = LabelEncoder()
         y = self.le.fit_transform(y)
 
-        if self.fit_intercept:
-            X = self._fit_intercept(X)
-            
-        self.m, self.n = X.shape
+        self.m, self.n = X.shape[0], X.shape[1] + int(self.fit_intercept)
         self.weights = np.zeros(self.n)
+        self.costs = []
+        monitor = ConvergenceMonitor(self.tol, self.n_iter_no_change)
+        optimizer = get_optimizer(self.optimizer, self.learning_rate, self.momentum)
+        start = int(self.fit_intercept)
+        gradient = np.empty(self.n)
         for step in range(self.num_iterations):
                     
-            preds = sigmoid(np.dot(X, self.weights))
+            preds = sigmoid(self._decision_function(X))
             error = preds - y
-            gradient = np.dot(X.T, error) / self.m
+            gradient[start:] = np.dot(X.T, error) / self.m
+            if self.fit_intercept:
+                gradient[0] = error.mean()
 
             if self.penalty:
-                self.weights[0] -= self.learning_rate * gradient[0]
-                self.weights[1:] -= self.learning_rate * (gradient[1:] + self.C * self.weights[1:] / self.m)
-            else:
-                self.weights -= self.learning_rate * gradient
+                gradient[start:] += self.C * self.weights[start:] / self.m
 
             if step % (self.num_iterations // self.steps) == 0:
                 cost = self.log_likelihood(preds = preds, 
                                                 target = y)
                 if self.print_cost: print(step, cost)
                 self.costs.append(cost)
+
+            if monitor.converged(grads=[gradient]):
+                break
+            optimizer.update([self.weights], [gradient])
+
+        self.n_iter_ = step + 1
         return self
     
     @property
     def intercept_(self):
-        return self.weights[:1]
+        if self.fit_intercept:
+            return self.weights[:1]
+        return np.zeros(1)
     
     @property
     def coef_(self):
-        return self.weights[1:].reshape(1, self.n - 1)
+        return self.weights[int(self.fit_intercept):].reshape(1, -1)
     
 
     def predict_proba(self, X):
-        if self.fit_intercept:
-            X = self._fit_intercept(X)
-    
-        return sigmoid(np.dot(X, self.weights))
+        return sigmoid(self._decision_function(X))
     
     def predict(self, X):
         return self.le.inverse_transform(self.predict_proba(X).round().astype(int))
@@ -280,7 +950,7 @@ class LogisticRegression_v1(BaseEstimator):
 
     
 
-class LogisticRegressionSGD(BaseEstimator):
+class LogisticRegressionSGD(LinearScoresMixin, BaseEstimator):
     """
     Logistic regression with stochastic gradient descent
     """
@@ -290,18 +960,22 @@ class LogisticRegressionSGD(BaseEstimator):
                         fit_intercept = True,
                         print_cost = False,
                         C = 0,
-                        penalty=None):
+                        penalty=None,
+                        tol=None,
+                        n_iter_no_change=5,
+                        optimizer='sgd',
+                        momentum=0.9):
         self.max_iter = int(max_iter)
         self.learning_rate = learning_rate
         self.fit_intercept = fit_intercept
         self.print_cost = print_cost
         self.C = 1 / C if C != 0 else 0
         self.penalty = penalty
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.optimizer = optimizer
+        self.momentum = momentum
 
-    def _fit_intercept(self, X):
-        intercept = np.ones((X.shape[0], 1))
-        return np.concatenate((intercept, X), axis=1)
-    
     def log_likelihood(self, preds, target):
         ll = - (target * np.log(preds + np.finfo(float).eps) + 
                 (1 - target) * np.log(1 - preds + np.finfo(float).eps)).sum() / self.m
@@ -309,45 +983,54 @@ class LogisticRegressionSGD(BaseEstimator):
 
     def fit(self, features, target):
 
-        if self.fit_intercept:
-            features = self._fit_intercept(features)
-        self.m, self.n = features.shape
+        self.m, self.n = features.shape[0], features.shape[1] + int(self.fit_intercept)
         self.weights = np.zeros(self.n)
+        self.costs = np.empty(self.max_iter)
+        monitor = ConvergenceMonitor(self.tol, self.n_iter_no_change)
+        optimizer = get_optimizer(self.optimizer, self.learning_rate, self.momentum)
+        start = int(self.fit_intercept)
+        coef = self.weights[start:]
 
-        for step in range(self.num_iterations):
+        for step in range(self.max_iter):
             for i, x in enumerate(features):
-                score = np.dot(x, self.weights)
+                score = np.dot(x, coef) + (self.weights[0] if start else 0)
                 pred = sigmoid(score)
                 error = pred - target[i]
-                gradient = np.dot(error, x)
+                gradient = np.empty(self.n)
+                gradient[start:] = np.dot(error, x)
+                if self.fit_intercept:
+                    gradient[0] = error
                 if self.penalty:
-                    self.weights[0] -= self.learning_rate * gradient[0]
-                    self.weights[1:] -= self.learning_rate * (gradient[1:] + self.C * self.weights[1:] / self.m)
-                else:
-                    self.weights -= self.learning_rate * gradient
+                    gradient[start:] += self.C * coef / self.m
+                optimizer.update([self.weights], [gradient])
+            cost = self.log_likelihood(preds = sigmoid(self._decision_function(features)),
+                                       target = target)
+            self.costs[step] = cost
             # Print log-likelihood every so often
-            if self.print_cost and step % (self.num_iterations//10) == 0:
-                print(step, self.log_likelihood(preds = sigmoid(np.dot(features, self.weights)),
-                                                target = target,
-                                                m = self.m))     
+            if self.print_cost and step % max(self.max_iter // 10, 1) == 0:
+                print(step, cost)
+            if monitor.converged(cost=cost):
+                break
+
+        self.n_iter_ = step + 1
+        self.costs = self.costs[:self.n_iter_]
         return self
 
     @property
     def intercept_(self):
-        return self.weights[:1]
+        if self.fit_intercept:
+            return self.weights[:1]
+        return np.zeros(1)
     
     @property
     def coef_(self):
-        return self.weights[1:].reshape(1, self.n - 1)
+        return self.weights[int(self.fit_intercept):].reshape(1, -1)
 
     def predict(self, X):
         return self.predict_proba(X).round()
 
     def predict_proba(self, X):     
-        if self.fit_intercept:
-            X = self._fit_intercept(X)
-    
-        return sigmoid(np.dot(X, self.weights.T))
+        return sigmoid(self._decision_function(X))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,270 @@
+"""
+Optimizers, stopping rules and cost bookkeeping shared by the gradient
+descent estimators
+"""
+import math
+
+import numpy as np
+
+
+class ConvergenceMonitor:
+    """
+    Decide when an iterative solver can stop.
+
+    Parameters
+    ----------
+    tol : float or None
+        None never stops early.
+    n_iter_no_change : int
+        Number of consecutive costs that did not improve on the best
+        cost by at least tol before stopping.
+    """
+    def __init__(self, tol=None, n_iter_no_change=5):
+        self.tol = tol
+        self.n_iter_no_change = n_iter_no_change
+        self.best_cost = np.inf
+        self.no_improvement = 0
+
+    def converged(self, cost=None, grads=None):
+        """
+        Args:
+            cost: scalar cost of the latest iteration, if it was computed
+            grads: list of gradient arrays of the full cost, if available
+        Return:
+            True once the largest absolute gradient entry is below tol or
+            the cost stopped improving for n_iter_no_change iterations
+        """
+        if self.tol is None:
+            return False
+
+        if grads is not None:
+            if max(np.abs(grad).max() for grad in grads) < self.tol:
+                return True
+
+        if cost is not None:
+            if cost > self.best_cost - self.tol:
+                self.no_improvement += 1
+            else:
+                self.no_improvement = 0
+            self.best_cost = min(self.best_cost, cost)
+            return self.no_improvement >= self.n_iter_no_change
+
+        return False
+
+
+class Penalty:
+    """
+    Penalty of strength c_lambda on the weights of a model trained on m
+    samples,
+
+        c_lambda / m * (l1_ratio * |w|_1 + (1 - l1_ratio) / 2 * |w|^2)
+
+    where 'l2' has an l1_ratio of 0 and 'l1' of 1. The smooth l2 part is
+    added to the gradient, the l1 part is applied by prox after every
+    update, which sets small weights exactly to zero. shrink applies the
+    l2 part after the update instead, which stays stable when
+    learning_rate * c_lambda / m is large.
+
+    Parameters
+    ----------
+    penalty : {None, 'l2', 'l1', 'elasticnet'}
+    c_lambda : float
+    l1_ratio : float
+        Share of the l1 part for 'elasticnet'.
+    """
+    def __init__(self, penalty=None, c_lambda=0, l1_ratio=0.15):
+        if penalty not in (None, 'l2', 'l1', 'elasticnet'):
+            raise ValueError("penalty should be None, 'l2', 'l1' or 'elasticnet', "
+                             "got %r" % penalty)
+        if penalty == 'elasticnet' and not 0 <= l1_ratio <= 1:
+            raise ValueError("l1_ratio should be in [0, 1], got %r" % l1_ratio)
+        ratio = {None: 0, 'l2': 0, 'l1': 1, 'elasticnet': l1_ratio}[penalty]
+        strength = c_lambda if penalty else 0
+        self.l1 = strength * ratio
+        self.l2 = strength * (1 - ratio)
+
+    def cost(self, coef, m):
+        """penalty of every row of coef"""
+        cost = np.zeros(coef.shape[:-1])
+        if self.l1:
+            cost += self.l1 * np.abs(coef).sum(axis=-1) / m
+        if self.l2:
+            cost += self.l2 * np.square(coef).sum(axis=-1) / (2 * m)
+        return cost
+
+    def gradient(self, coef, m):
+        """gradient of the smooth part"""
+        return self.l2 * coef / m
+
+    def prox(self, coef, learning_rate, m):
+        """soft-threshold coef in place after a step of learning_rate"""
+        if self.l1:
+            threshold = learning_rate * self.l1 / m
+            np.copyto(coef, np.sign(coef) * np.maximum(np.abs(coef) - threshold, 0))
+
+    def shrink(self, coef, learning_rate, m):
+        """
+        Scale coef in place by the exact implicit step of the l2 part,
+        1 / (1 + learning_rate * l2 / m), in place of its gradient.
+        After prox this is the proximal step of the whole penalty.
+        """
+        if self.l2:
+            coef /= 1 + learning_rate * self.l2 / m
+
+    def gradient_mapping(self, coef, grad, learning_rate, m):
+        """
+        Return:
+            the step a proximal gradient update of coef would take,
+            divided by learning_rate. It is grad without an l1 part and
+            vanishes at the optimum like the gradient of a smooth cost.
+        """
+        if not self.l1:
+            return grad
+        stepped = coef - learning_rate * grad
+        self.prox(stepped, learning_rate, m)
+        return (coef - stepped) / learning_rate
+
+
+class Optimizer:
+    """
+    Update a list of parameter arrays in place from their gradients.
+
+    Subclasses implement _direction, which returns the change of one
+    parameter and may keep per-parameter state between updates.
+    learning_rate can be changed between updates to follow a schedule.
+    """
+    def __init__(self, learning_rate=0.01):
+        self.learning_rate = learning_rate
+        self.state = {}
+        self.t = 0
+
+    def update(self, params, grads):
+        """
+        Args:
+            params: list of arrays, updated in place
+            grads: list of gradients with the same shapes as params
+        """
+        self.t += 1
+        for i, (param, grad) in enumerate(zip(params, grads)):
+            param += self._direction(i, grad)
+
+    def _direction(self, i, grad):
+        raise NotImplementedError
+
+
+class SGD(Optimizer):
+    """
+    Gradient descent with optional (Nesterov) momentum.
+    """
+    def __init__(self, learning_rate=0.01, momentum=0.0, nesterov=False):
+        super().__init__(learning_rate)
+        self.momentum = momentum
+        self.nesterov = nesterov
+
+    def _direction(self, i, grad):
+        if not self.momentum:
+            return -self.learning_rate * grad
+        velocity = self.state.get(i, 0)
+        velocity = self.momentum * velocity - self.learning_rate * grad
+        self.state[i] = velocity
+        if self.nesterov:
+            return self.momentum * velocity - self.learning_rate * grad
+        return velocity
+
+
+class AdaGrad(Optimizer):
+    """
+    Scale every coordinate by the root of its summed squared gradients.
+    """
+    def __init__(self, learning_rate=0.01, epsilon=1e-8):
+        super().__init__(learning_rate)
+        self.epsilon = epsilon
+
+    def _direction(self, i, grad):
+        self.state[i] = self.state.get(i, 0) + np.square(grad)
+        return -self.learning_rate * grad / (np.sqrt(self.state[i]) + self.epsilon)
+
+
+class RMSProp(Optimizer):
+    """
+    Scale every coordinate by the root of a moving average of its
+    squared gradients.
+    """
+    def __init__(self, learning_rate=0.001, rho=0.9, epsilon=1e-8):
+        super().__init__(learning_rate)
+        self.rho = rho
+        self.epsilon = epsilon
+
+    def _direction(self, i, grad):
+        self.state[i] = self.rho * self.state.get(i, 0) + (1 - self.rho) * np.square(grad)
+        return -self.learning_rate * grad / (np.sqrt(self.state[i]) + self.epsilon)
+
+
+class Adam(Optimizer):
+    """
+    RMSProp on a bias corrected moving average of the gradients.
+    """
+    def __init__(self, learning_rate=0.001, beta1=0.9, beta2=0.999, epsilon=1e-8):
+        super().__init__(learning_rate)
+        self.beta1 = beta1
+        self.beta2 = beta2
+        self.epsilon = epsilon
+
+    def _direction(self, i, grad):
+        first, second = self.state.get(i, (0, 0))
+        first = self.beta1 * first + (1 - self.beta1) * grad
+        second = self.beta2 * second + (1 - self.beta2) * np.square(grad)
+        self.state[i] = first, second
+        first_hat = first / (1 - self.beta1 ** self.t)
+        second_hat = second / (1 - self.beta2 ** self.t)
+        return -self.learning_rate * first_hat / (np.sqrt(second_hat) + self.epsilon)
+
+
+def cost_sample_rows(n_samples, cost_sample, rng):
+    """
+    Args:
+        n_samples: number of rows in the training set
+        cost_sample: None for all the rows, an int number of rows or a
+            float fraction of them
+        rng: RandomState that draws the subsample
+    Return:
+        sorted indices of a fixed subsample to evaluate the cost on,
+        None when the cost should use every row
+    """
+    if cost_sample is None:
+        return None
+    if isinstance(cost_sample, float):
+        if not 0 < cost_sample <= 1:
+            raise ValueError("a float cost_sample should be in (0, 1], "
+                             "got %r" % cost_sample)
+        cost_sample = int(math.ceil(cost_sample * n_samples))
+    if cost_sample < 1:
+        raise ValueError("cost_sample should be at least 1, got %r" % cost_sample)
+    if cost_sample >= n_samples:
+        return None
+    return np.sort(rng.choice(n_samples, cost_sample, replace=False))
+
+
+def get_optimizer(name, learning_rate, momentum=0.9):
+    """
+    Args:
+        name: one of 'sgd', 'momentum', 'nesterov', 'adagrad', 'rmsprop', 'adam'
+        learning_rate: initial step size
+        momentum: used by 'momentum' and 'nesterov'
+    Return:
+        a new Optimizer
+    """
+    if name == 'sgd':
+        return SGD(learning_rate)
+    if name == 'momentum':
+        return SGD(learning_rate, momentum=momentum)
+    if name == 'nesterov':
+        return SGD(learning_rate, momentum=momentum, nesterov=True)
+    if name == 'adagrad':
+        return AdaGrad(learning_rate)
+    if name == 'rmsprop':
+        return RMSProp(learning_rate)
+    if name == 'adam':
+        return Adam(learning_rate)
+    raise ValueError("optimizer should be one of 'sgd', 'momentum', 'nesterov', "
+                     "'adagrad', 'rmsprop' or 'adam', got %r" % name)
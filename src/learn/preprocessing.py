@@ -0,0 +1,101 @@
+"""
+Feature expansion
+"""
+from itertools import chain, combinations_with_replacement
+
+import numpy as np
+
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import gen_batches
+
+
+class PolynomialFeatures(TransformerMixin, BaseEstimator):
+    """
+    All the products of at most degree features, in the order of
+    sklearn.preprocessing.PolynomialFeatures.
+
+    Every term of degree d is a term of degree d - 1 times one feature,
+    so each degree is a few vectorized multiplications of column blocks
+    of the previous one instead of a power per term. The number of terms,
+    comb(n_features + degree, degree), grows quickly: transform_chunks
+    expands a few rows at a time, to be fed to partial_fit,
+
+        poly = PolynomialFeatures(6).fit(X)
+        reg = Ridge(fit_intercept=False)
+        for rows, XP in poly.transform_chunks(X):
+            reg.partial_fit(XP, y[rows])
+        reg.finalize()
+
+    Parameters
+    ----------
+    degree : int, default 2
+    include_bias : bool, default True
+        Start with a column of ones.
+
+    Attributes
+    ----------
+    n_features_in_ : int
+    n_output_features_ : int
+    powers_ : array, shape (n_output_features_, n_features_in_)
+        Exponent of every input feature in every output column.
+    """
+    def __init__(self, degree=2, include_bias=True):
+        self.degree = degree
+        self.include_bias = include_bias
+
+    def fit(self, X, y=None):
+        if self.degree < 0:
+            raise ValueError("degree should be at least 0, got %r" % self.degree)
+        self.n_features_in_ = X.shape[1]
+        terms = chain.from_iterable(combinations_with_replacement(range(self.n_features_in_), d)
+                                    for d in range(int(not self.include_bias), self.degree + 1))
+        self.powers_ = np.array([np.bincount(term, minlength=self.n_features_in_)
+                                 for term in terms], dtype=int).reshape((-1, self.n_features_in_))
+        self.n_output_features_ = self.powers_.shape[0]
+        return self
+
+    def transform(self, X):
+        """
+        Args:
+            X: (m, n_features_in_)
+        Return:
+            (m, n_output_features_)
+        """
+        X = np.asarray(X)
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError("X has %d features, expected %d" % (X.shape[1], self.n_features_in_))
+        dtype = X.dtype if np.issubdtype(X.dtype, np.floating) else np.float64
+        XP = np.empty((X.shape[0], self.n_output_features_), dtype=dtype)
+        col = 0
+        if self.include_bias:
+            XP[:, 0] = 1
+            col = 1
+        if self.degree == 0:
+            return XP
+        XP[:, col:col + self.n_features_in_] = X
+        # start[j]: first column of the previous degree whose terms only
+        # hold features >= j, those times feature j are the next degree
+        start = list(range(col, col + self.n_features_in_))
+        col += self.n_features_in_
+        start.append(col)
+        for _ in range(2, self.degree + 1):
+            next_start, end = [], start[-1]
+            for j in range(self.n_features_in_):
+                next_start.append(col)
+                width = end - start[j]
+                np.multiply(XP[:, start[j]:end], X[:, j:j + 1], out=XP[:, col:col + width])
+                col += width
+            next_start.append(col)
+            start = next_start
+        return XP
+
+    def transform_chunks(self, X, chunk_size=65536):
+        """
+        Expand X chunk_size rows at a time.
+
+        Return:
+            generator of (rows, XP), rows a slice of X and XP the
+            transform of X[rows]
+        """
+        for rows in gen_batches(X.shape[0], chunk_size):
+            yield rows, self.transform(X[rows])
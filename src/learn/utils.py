@@ -85,10 +85,10 @@ def predict_image(clf, fname, num_px, classes, plot_image=False):
 
 def plot_costs(clf):
 
-    if clf.costs.ndim > 1:
-        plt.plot(clf.costs.T.mean(axis=1))
-    else:
-        plt.plot(clf.costs)
+    costs = clf.costs.T.mean(axis=1) if clf.costs.ndim > 1 else clf.costs
+    # estimators that skip iterations with cost_every say which were recorded
+    iters = getattr(clf, 'cost_iters_', np.arange(len(costs)))
+    plt.plot(iters, costs)
     plt.ylabel('cost')
     plt.xlabel('iterations')
     if getattr(clf, 'learning_rate', None):
@@ -113,6 +113,10 @@ def contour_plot(X, y, model):
 
 
 def plot_boundary(clf, X, y, grid_step=.01, poly_featurizer=None):
+    """
+    poly_featurizer: fitted transformer of the 2-D grid points, like
+        learn.preprocessing.PolynomialFeatures, None to predict on them
+    """
     x_min, x_max = X[:, 0].min() - .1, X[:, 0].max() + .1
     y_min, y_max = X[:, 1].min() - .1, X[:, 1].max() + .1
     xx, yy = np.meshgrid(np.arange(x_min, x_max, grid_step),
@@ -121,7 +125,10 @@ def plot_boundary(clf, X, y, grid_step=.01, poly_featurizer=None):
 
     # to every point from [x_min, m_max]x[y_min, y_max]
     # we put in correspondence its own color
-    Z = clf.predict(poly_featurizer.transform(np.c_[xx.ravel(), yy.ravel()]))
+    grid = np.c_[xx.ravel(), yy.ravel()]
+    if poly_featurizer is not None:
+        grid = poly_featurizer.transform(grid)
+    Z = clf.predict(grid)
     Z = Z.reshape(xx.shape)
     plt.contour(xx, yy, Z, cmap=plt.cm.Paired)
 
@@ -139,13 +146,13 @@ def construct_polynomial_feats(x, degree):
          ......
         ]
     """
-    
-    n = x.shape[0]
-    res = np.empty((degree+1,n))
-    for i in range(degree+1):
-        res[i] = np.power(x,i)
-    
-    return res.T
+    feat = np.empty((x.shape[0], degree + 1))
+    feat[:, 0] = 1
+    # every power is the previous one times x, see
+    # learn.preprocessing.PolynomialFeatures for several features
+    for i in range(1, degree + 1):
+        np.multiply(feat[:, i - 1], x, out=feat[:, i])
+    return feat
 
 
 def plot_curve(x, y, curve_type='.', color='b', lw=2):
@@ -59,18 +59,20 @@ class TestSK:
             print()
 
 def test(classifier, X_train, X_test, y_train, y_test,
-         report=False):
+         report=False, densify=True):
     """
     Evaluate the performance of One single classifier
     print confusion matrix and accuracy
     Args:
         report: T/F, whether to print classification report
+        densify: T/F, whether to convert sparse X to dense arrays,
+            pass False for classifiers that accept sparse input
 
     Returns:
         classifier: fitted classifier
     """
     print(f'testing {classifier}')
-    if issparse(X_train):
+    if densify and issparse(X_train):
         X_train = X_train.toarray()
         X_test = X_test.toarray()
     classifier.fit(X_train, y_train)
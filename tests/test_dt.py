@@ -14,7 +14,8 @@ import numpy as np
 import pandas as pd
 
 from learn.dt import DecisionTree, DecisionTreeD
-# from learn.dt import _find_best_feature
+from learn.dt import _find_best_feature, _find_best_split, _partition_classes
+from learn.dt import _information_gain, entropy
 
 from sklearn.metrics import accuracy_score
 from sklearn import tree
@@ -40,6 +41,48 @@ def test_find_best_feature():
 
 
 
+def test_sweep_split():
+    """the sweep scores every threshold like a partition at each value"""
+    rng = np.random.RandomState(0)
+    X = np.round(rng.randn(200, 3), 1)
+    y = rng.randint(0, 3, 200)
+    y_entropy = entropy(y)
+    for split_attribute in range(X.shape[1]):
+        vals = np.unique(X[:, split_attribute])
+        gains = [_information_gain(_partition_classes(X, y, split_attribute, val)[2:], y_entropy)
+                 for val in vals]
+        split_val, info_gain = _find_best_split(X, y, split_attribute, y_entropy)
+        assert split_val == vals[np.argmax(gains)]
+        assert info_gain == pytest.approx(max(gains))
+
+
+def _same_tree(a, b):
+    if a.is_leaf or b.is_leaf:
+        return a.is_leaf == b.is_leaf and a.val == b.val
+    return (a.feature_to_split == b.feature_to_split and a.split_val == b.split_val
+            and _same_tree(a.left, b.left) and _same_tree(a.right, b.right))
+
+
+def test_histogram_dt():
+    """with a bin per unique value the histogram tree is the exact one"""
+    rng = np.random.RandomState(0)
+    X = rng.randint(0, 10, (400, 4)).astype(float)
+    y = ((X[:, 0] * X[:, 1] + X[:, 2]) % 3 == 0).astype(int)
+    clf = DecisionTreeD(verbose=False).fit(X, y)
+    clf_h = DecisionTreeD(verbose=False, max_bins=10).fit(X, y)
+    assert _same_tree(clf, clf_h)
+
+
+def test_histogram_dt_quantile_bins():
+    from sklearn.datasets import load_breast_cancer
+    X, y = load_breast_cancer(return_X_y=True)
+    clf = DecisionTreeD(verbose=False, max_bins=32).fit(X, y)
+    assert all(edges.shape[0] < 32 for edges in clf.bin_edges_)
+    assert accuracy_score(y, clf.bunch_predict(X)) == 1.0
+    with pytest.raises(ValueError):
+        DecisionTreeD(verbose=False, max_bins=256).fit(X, y)
+
+
 @pytest.mark.smoke
 def test_basic_dt():
     X = np.array([[0, 0], 
@@ -9,14 +9,16 @@ import pytest
 from pytest import approx
 
 import numpy as np
+from scipy import sparse
 from sklearn import linear_model, datasets
 from sklearn.metrics import mean_squared_error, r2_score
 from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import mean_squared_error as mse
 
-from lm import LinearRegression, SGDRegressor
-from utils import construct_polynomial_feats
+from learn.lm import LinearRegression, Ridge, SGDRegressor, least_squares, sgd_regression_path, SOLVERS
+from learn.lm import RecursiveLeastSquares, RidgeCV, normal_equations
+from learn.utils import construct_polynomial_feats
 from evaluation import within
 
 def test_batch_sgdregressor():
@@ -78,6 +80,327 @@ def test_basic_sgdregressor():
     assert np.allclose(sksgdreg.coef_,  sgdreg_batch.coef_)
     assert np.allclose(sksgdreg.intercept_,  sgdreg.intercept_)
     assert np.allclose(sksgdreg.intercept_,  sgdreg_batch.intercept_)
+
+@pytest.mark.smoke
+def test_sgdregressor_early_stopping():
+    X = np.array([[1, 1], [1, 2], [2, 2], [2, 3]])
+    y = np.dot(X, np.array([1, 2])) + 3
+    reg = SGDRegressor(learning_rate=1e-1, batch=True, max_iter=1e5, tol=1e-6)
+    reg.fit(X, y)
+    assert reg.n_iter_ < 1e5
+    assert reg.costs.shape == (reg.n_iter_,)
+    assert reg.score(X, y) == approx(1.0)
+
+    reg = SGDRegressor(learning_rate=1e-1, max_iter=1e5, tol=1e-6)
+    reg.fit(X, y)
+    assert reg.n_iter_ < 1e5
+    assert reg.score(X, y) == approx(1.0)
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize("batch", [False, True])
+def test_sgdregressor_cost_every(batch):
+    X = np.random.RandomState(0).randn(200, 3)
+    y = np.dot(X, np.array([1, 2, 3])) + 1
+    reg = SGDRegressor(learning_rate=1e-2, batch=batch, max_iter=20).fit(X, y.copy())
+    lazy = SGDRegressor(learning_rate=1e-2, batch=batch, max_iter=20,
+                        cost_every=5, cost_sample=100, random_state=0).fit(X, y.copy())
+    assert np.array_equal(reg.coef_, lazy.coef_)
+    assert np.array_equal(lazy.cost_iters_, [0, 5, 10, 15])
+    assert np.allclose(lazy.costs, reg.costs[::5], rtol=0.5)
+
+
+@pytest.mark.parametrize("penalty, skreg", [
+    ('l1', linear_model.Lasso(alpha=1.0, tol=1e-10, max_iter=100000)),
+    ('elasticnet', linear_model.ElasticNet(alpha=1.0, l1_ratio=0.15, tol=1e-10,
+                                           max_iter=100000))])
+def test_sgdregressor_l1_penalty(penalty, skreg):
+    """
+    batch proximal gradient descent with c_lambda = m * alpha solves
+    sklearn's Lasso and ElasticNet
+    """
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = StandardScaler().fit_transform(X)
+    reg = SGDRegressor(penalty=penalty, c_lambda=X.shape[0], batch=True,
+                       learning_rate=1e-1, max_iter=1e5, tol=1e-8).fit(X, y.copy())
+    skreg.fit(X, y)
+    assert np.allclose(reg.coef_, skreg.coef_, atol=1e-5)
+    assert reg.intercept_ == approx(skreg.intercept_)
+
+    preds = reg.predict(X)
+    reg.sparsify()
+    assert np.allclose(reg.predict(X), preds)
+
+
+@pytest.mark.smoke
+@pytest.mark.parametrize("solver", SOLVERS)
+@pytest.mark.parametrize("fit_intercept", [True, False])
+def test_least_squares_solvers(solver, fit_intercept):
+    X, y = datasets.load_diabetes(return_X_y=True)
+    reg = LinearRegression(solver=solver, fit_intercept=fit_intercept, tol=1e-12).fit(X, y)
+    skreg = linear_model.LinearRegression(fit_intercept=fit_intercept).fit(X, y)
+    assert np.allclose(reg.coef_, skreg.coef_)
+    assert reg.intercept_ == approx(skreg.intercept_)
+
+    ridge = Ridge(alpha=0.5, solver=solver, fit_intercept=fit_intercept, tol=1e-12).fit(X, y)
+    skridge = linear_model.Ridge(alpha=0.5, fit_intercept=fit_intercept).fit(X, y)
+    assert np.allclose(ridge.coef_, skridge.coef_)
+    assert ridge.intercept_ == approx(skridge.intercept_)
+    penalized = LinearRegression(penalty='l2', c_lambda=0.5, solver=solver,
+                                 fit_intercept=fit_intercept, tol=1e-12).fit(X, y)
+    assert np.allclose(penalized.weights, ridge.weights)
+    # fitting twice must not change the penalty
+    assert np.allclose(penalized.fit(X, y).weights, ridge.weights)
+
+
+@pytest.mark.parametrize("solver", ['auto', 'cholesky', 'lstsq', 'svd'])
+def test_rank_deficient_least_squares(solver):
+    """duplicated columns get the minimum norm solution, like pinv"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = np.hstack((X, X[:, :2]))
+    reg = LinearRegression(solver=solver).fit(X, y)
+    expected = np.linalg.pinv(reg._fit_intercept(X)).dot(y)
+    assert np.allclose(reg.weights, expected)
+
+
+@pytest.mark.parametrize("solver", ['auto', 'cholesky', 'qr', 'lstsq', 'svd'])
+def test_wide_least_squares(solver):
+    """fewer rows than columns get the minimum norm solution"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X, y = X[:8], y[:8]
+    assert np.allclose(least_squares(X, y, solver), np.linalg.pinv(X).dot(y))
+
+
+@pytest.mark.parametrize("solver", ['cg', 'lsqr', 'lsmr', 'bogus'])
+def test_least_squares_direct_solvers_only(solver):
+    X, y = datasets.load_diabetes(return_X_y=True)
+    with pytest.raises(ValueError):
+        least_squares(X, y, solver)
+
+
+def test_n_iter_direct_solvers():
+    """n_iter_ of an iterative fit does not outlive a direct one"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    reg = LinearRegression(solver='lsqr').fit(X, y)
+    assert reg.n_iter_.shape == (1,)
+    assert reg.set_params(solver='cholesky').fit(X, y).n_iter_ is None
+    reg.set_params(solver='lsqr').fit(X, y)
+    assert reg.partial_fit(X, y).finalize().n_iter_ is None
+
+
+@pytest.mark.parametrize("reg", [LinearRegression(), LinearRegression(fit_intercept=False),
+                                 Ridge(alpha=0.3), Ridge(alpha=0.3, fit_intercept=False)])
+def test_partial_fit_normal_equations(reg):
+    """accumulating chunks fits the same model as fit on all the rows"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    weights = reg.fit(X, y).weights.copy()
+    for chunk in np.array_split(np.arange(X.shape[0]), 7):
+        reg.partial_fit(X[chunk], y[chunk])
+    assert np.allclose(reg.finalize().weights, weights)
+
+
+def test_partial_fit_large_means():
+    """centered statistics do not lose the signal under large means"""
+    rng = np.random.RandomState(0)
+    X = rng.randn(10000, 5)
+    y = np.dot(X, np.arange(5.)) + 3 + 0.1 * rng.randn(10000)
+    reg = LinearRegression()
+    for chunk in np.array_split(np.arange(X.shape[0]), 10):
+        reg.partial_fit(X[chunk] + 1e6, y[chunk])
+    reg.finalize()
+    expected = LinearRegression().fit(X, y)
+    assert np.allclose(reg.coef_, expected.coef_, atol=1e-6)
+
+
+@pytest.mark.parametrize("solver", ['auto', 'cholesky', 'qr'])
+def test_intercept_by_centering(solver):
+    """the intercept is fitted on centered X, accurate under large means"""
+    rng = np.random.RandomState(0)
+    X = rng.randn(10000, 5)
+    y = np.dot(X, np.arange(5.)) + 3 + 0.1 * rng.randn(10000)
+    expected = LinearRegression(fit_intercept=False).fit(np.hstack((np.ones((10000, 1)), X)), y)
+    reg = LinearRegression(solver=solver).fit(X + 1e6, y)
+    assert np.allclose(reg.coef_, expected.weights[1:], atol=1e-6)
+    assert np.allclose(reg.predict(X + 1e6), expected.predict(np.hstack((np.ones((10000, 1)), X))))
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_parallel_normal_equations(tmp_path, n_jobs):
+    """summing blocks of a memory-mapped X gives the same model"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    np.save(tmp_path / 'X.npy', X)
+    X_map = np.load(tmp_path / 'X.npy', mmap_mode='r')
+    stats = normal_equations(X_map, y, n_jobs=n_jobs, chunk_size=50)
+    assert stats.n_samples_ == X.shape[0]
+    assert np.allclose(stats.x_mean_, X.mean(axis=0))
+    assert np.allclose(stats.xx_, np.cov(X.T, bias=True) * X.shape[0])
+
+    for reg in (LinearRegression, Ridge):
+        expected = reg().fit(X, y).weights
+        assert np.allclose(reg(n_jobs=n_jobs).fit(X_map, y).weights, expected)
+        assert np.allclose(reg(n_jobs=2).fit(X, y).weights, expected)
+
+
+def test_ridgecv_leave_one_out():
+    """the closed form errors are those of refitting without every sample"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X, y = X[:60], y[:60]
+    alphas = [0.01, 0.1, 1.0]
+    reg = RidgeCV(alphas=alphas).fit(X, y)
+    for alpha, error in zip(alphas, reg.cv_errors_[:, 0]):
+        squared_errors = []
+        for i in range(X.shape[0]):
+            rest = np.arange(X.shape[0]) != i
+            ridge = Ridge(alpha=alpha).fit(X[rest], y[rest])
+            squared_errors.append((ridge.predict(X[i:i + 1])[0] - y[i]) ** 2)
+        assert error == approx(np.mean(squared_errors))
+    assert reg.alpha_ == alphas[reg.cv_errors_.argmin()]
+    assert np.allclose(reg.weights, Ridge(alpha=reg.alpha_).fit(X, y).weights)
+
+
+@pytest.mark.parametrize("fit_intercept", [True, False])
+@pytest.mark.parametrize("alpha_per_target", [True, False])
+def test_ridgecv_matches_sklearn(fit_intercept, alpha_per_target):
+    X, y = datasets.load_diabetes(return_X_y=True)
+    Y = np.c_[y, np.random.RandomState(0).randn(y.shape[0])]
+    alphas = np.logspace(-4, 2, 13)
+    reg = RidgeCV(alphas=alphas, fit_intercept=fit_intercept,
+                  alpha_per_target=alpha_per_target).fit(X, Y)
+    skreg = linear_model.RidgeCV(alphas=alphas, fit_intercept=fit_intercept,
+                                 alpha_per_target=alpha_per_target).fit(X, Y)
+    assert np.allclose(reg.alpha_, skreg.alpha_)
+    assert np.allclose(reg.coef_.T, skreg.coef_)
+    assert np.allclose(reg.predict(X), skreg.predict(X))
+
+
+def test_ridgecv_streaming_api():
+    """RidgeCV needs all the rows at once, it has no streaming methods"""
+    assert not hasattr(RidgeCV(), 'partial_fit')
+    assert not hasattr(RidgeCV(), 'finalize')
+
+
+@pytest.mark.smoke
+def test_minibatch_sgdregressor():
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = StandardScaler().fit_transform(X)
+    online = SGDRegressor(max_iter=20, learning_rate=1e-2).fit(X, y)
+    single = SGDRegressor(max_iter=20, learning_rate=1e-2, batch_size=1).fit(X, y)
+    assert np.array_equal(online.coef_, single.coef_)
+    # one batch of all the rows is batch gradient descent
+    full = SGDRegressor(max_iter=20, learning_rate=1e-1, batch_size=X.shape[0]).fit(X, y)
+    batch = SGDRegressor(max_iter=20, learning_rate=1e-1, batch=True).fit(X, y)
+    assert np.allclose(full.coef_, batch.coef_)
+    assert np.allclose(full.intercept_, batch.intercept_)
+
+    params = dict(max_iter=200, learning_rate=1e-2, batch_size=16, shuffle=True,
+                  random_state=0)
+    reg = SGDRegressor(**params).fit(X, y)
+    assert np.array_equal(reg.coef_, SGDRegressor(**params).fit(X, y).coef_)
+    assert reg.score(X, y) == approx(r2_score(y, LinearRegression().fit(X, y).predict(X)), abs=1e-2)
+    assert y.ndim == 1
+
+
+@pytest.mark.parametrize("params", [dict(), dict(fit_intercept=False), dict(shuffle=True),
+                                    dict(penalty='l2', c_lambda=10.),
+                                    dict(penalty='elasticnet', c_lambda=10.)])
+def test_single_sample_sgdregressor(params):
+    """the per-sample loop of plain sgd takes the steps of the generic one"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = StandardScaler().fit_transform(X)
+    params = dict(max_iter=5, learning_rate=1e-2, random_state=0, **params)
+    fast = SGDRegressor(**params).fit(X, y)
+    # momentum 0 is plain sgd through the optimizer
+    generic = SGDRegressor(optimizer='momentum', momentum=0, **params).fit(X, y)
+    assert np.allclose(fast.coef_, generic.coef_)
+    assert np.allclose(fast.intercept_, generic.intercept_)
+    assert np.allclose(fast.costs, generic.costs)
+
+
+@pytest.mark.parametrize("solver", ['cg', 'lsqr', 'lsmr'])
+@pytest.mark.parametrize("fit_intercept", [True, False])
+def test_iterative_solvers_sparse(solver, fit_intercept):
+    """sparse X is solved without densifying, like the dense direct solvers"""
+    rng = np.random.RandomState(0)
+    X = sparse.random(500, 40, density=0.1, format='csr', random_state=rng)
+    Y = X.dot(rng.randn(40, 2)) + 3 + 0.1 * rng.randn(500, 2)
+    for reg, expected in [(LinearRegression(solver=solver, fit_intercept=fit_intercept, tol=1e-10),
+                           LinearRegression(fit_intercept=fit_intercept)),
+                          (Ridge(alpha=0.5, solver=solver, fit_intercept=fit_intercept, tol=1e-10),
+                           Ridge(alpha=0.5, fit_intercept=fit_intercept))]:
+        expected.fit(X.toarray(), Y[:, 0])
+        assert np.allclose(reg.fit(X, Y[:, 0]).weights, expected.weights)
+        assert reg.n_iter_.shape == (1,)
+        assert np.allclose(reg.predict(X), expected.predict(X.toarray()))
+        # every target is solved on its own
+        expected.fit(X.toarray(), Y)
+        assert np.allclose(reg.fit(X, Y).weights, expected.weights)
+
+    capped = LinearRegression(solver=solver, max_iter=2).fit(X, Y[:, 0])
+    assert capped.n_iter_[0] <= 2
+    assert LinearRegression().fit(X, Y[:, 0]).n_iter_[0] > 0
+
+
+def test_recursive_least_squares():
+    """row by row and batch updates both reach the least squares fit"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    expected = LinearRegression().fit(X, y)
+    rls = RecursiveLeastSquares(alpha=1e-8)
+    for i in range(X.shape[0]):
+        rls.partial_fit(X[i:i + 1], y[i:i + 1])
+    assert np.allclose(rls.weights, expected.weights)
+    assert rls.m == X.shape[0]
+    assert np.allclose(rls.predict(X), expected.predict(X))
+
+    Y = np.column_stack((y, -2 * y))
+    rls = RecursiveLeastSquares(alpha=1e-8, fit_intercept=False)
+    for chunk in np.array_split(np.arange(X.shape[0]), 9):
+        rls.partial_fit(X[chunk], Y[chunk])
+    assert np.allclose(rls.weights, LinearRegression(fit_intercept=False).fit(X, Y).weights)
+
+
+def test_recursive_least_squares_forgetting():
+    """older batches are discounted by forgetting_factor per batch"""
+    X, y = datasets.load_diabetes(return_X_y=True)
+    lam, chunks = 0.9, np.array_split(np.arange(X.shape[0]), 20)
+    rls = RecursiveLeastSquares(alpha=1.0, forgetting_factor=lam)
+    for chunk in chunks:
+        rls.partial_fit(X[chunk], y[chunk])
+
+    Xa = np.hstack((np.ones((X.shape[0], 1)), X))
+    w = np.concatenate([np.full(len(chunk), lam ** (len(chunks) - 1 - t))
+                        for t, chunk in enumerate(chunks)])
+    gram = np.dot(Xa.T * w, Xa) + lam ** len(chunks) * np.eye(Xa.shape[1])
+    assert np.allclose(rls.weights, np.linalg.solve(gram, np.dot(Xa.T * w, y)))
+    with pytest.raises(ValueError):
+        RecursiveLeastSquares(forgetting_factor=0).fit(X, y)
+
+
+def test_sgd_regression_path():
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = StandardScaler().fit_transform(X)
+    params = dict(batch=True, learning_rate=0.1, max_iter=1e5, tol=1e-4)
+    lambdas, coefs, intercepts, n_iters = sgd_regression_path(
+        X, y, [1, 10, 100], **params)
+    assert np.array_equal(lambdas, [100, 10, 1])
+    assert coefs.shape == (3, X.shape[1])
+
+    reg = SGDRegressor(penalty='l2', c_lambda=1, **params).fit(X, y)
+    assert np.allclose(reg.coef_.ravel(), coefs[-1], atol=1e-2)
+    assert n_iters[-1] < reg.n_iter_
+
+def test_adam_on_unscaled_features():
+    """
+    adaptive step sizes make up for features on very different scales
+    """
+    X, y = datasets.load_diabetes(return_X_y=True)
+    X = X * np.logspace(0, 3, X.shape[1])
+    sgd = SGDRegressor(batch=True, learning_rate=1e-7, max_iter=2000).fit(X, y)
+    adam = SGDRegressor(batch=True, optimizer='adam', learning_rate=0.5,
+                        max_iter=2000).fit(X, y)
+    skreg = linear_model.LinearRegression().fit(X, y)
+    assert adam.score(X, y) == approx(skreg.score(X, y), abs=1e-3)
+    assert adam.score(X, y) > sgd.score(X, y) + 0.1
+
 # sgdreg.coef_, sgdreg.intercept_ 
 # sgdreg.predict(np.array([[3, 5]]))
 
@@ -18,6 +18,7 @@ import pytest
 from pytest import approx
 
 import numpy as np
+from scipy import sparse
 from sklearn import datasets
 from sklearn import linear_model
 from sklearn.model_selection import train_test_split
@@ -25,6 +26,7 @@ from sklearn.model_selection import GridSearchCV
 from sklearn.metrics import classification_report,confusion_matrix, accuracy_score
 
 from learn import LogisticRegression
+from learn.lr import shuffled_batches, logistic_regression_path
 from evaluation import within
 
 from pprint import pprint
@@ -288,4 +290,367 @@ def test_perceptron(cancer):
     # print()
     s = clf.score(X, y)
     print(s)
-    assert s > 0.9
\ No newline at end of file
+    assert s > 0.9
+
+@pytest.mark.pla
+def test_averaged_perceptron(iris):
+    """
+    the windowed online perceptron makes the same updates as visiting
+    the rows one at a time
+    """
+    X, y = iris
+    clf = LogisticRegression(sgd=True, loss="perceptron", random_state=0,
+                             max_iter=5, tol=None, learning_rate=0.3)
+    clf.fit(X, y)
+    assert clf.costs.shape == (3, clf.n_iter_)
+    assert clf.predict(X).shape == y.shape
+
+    S = 2. * (y[:, np.newaxis] == np.unique(y)) - 1
+    coef, intercept = np.zeros((3, 4)), np.zeros(3)
+    coef_sum, intercept_sum = np.zeros((3, 4)), np.zeros(3)
+    rng, indices = np.random.RandomState(0), np.arange(X.shape[0])
+    for _ in range(clf.n_iter_):
+        rng.shuffle(indices)
+        for i in indices:
+            delta = 0.3 * S[i] * (S[i] * (coef.dot(X[i]) + intercept) <= 0)
+            coef += np.outer(delta, X[i])
+            intercept += delta
+            coef_sum += coef
+            intercept_sum += intercept
+    steps = clf.n_iter_ * X.shape[0]
+    # the average includes the zero weights before the first update
+    assert np.allclose(clf.coef_, coef_sum / (steps + 1))
+    assert np.allclose(clf.intercept_, intercept_sum / (steps + 1))
+
+
+@pytest.mark.pla
+@pytest.mark.parametrize("batch_size", [16, None])
+def test_block_perceptron(cancer, batch_size):
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    clf = LogisticRegression(sgd=batch_size is not None, batch_size=batch_size,
+                             loss="perceptron", random_state=0, max_iter=50)
+    assert clf.fit(X, y).score(X, y) > 0.95
+
+
+@pytest.mark.smoke
+def test_multiclass_matches_binary_ovr(iris):
+    """
+    the vectorized multiclass fit should give the same coef_ as
+    fitting every one-vs-rest problem separately
+    """
+    X, y = iris
+    clf = LogisticRegression(max_iter=200, learning_rate=1e-1)
+    clf.fit(X, y)
+    assert clf.costs.shape == (3, 200)
+    for i, c in enumerate(clf.classes_):
+        binary = LogisticRegression(max_iter=200, learning_rate=1e-1)
+        binary.fit(X, np.where(y == c, 1, 0))
+        assert np.allclose(clf.coef_[i], binary.coef_[0])
+        assert clf.intercept_[i] == approx(binary.intercept_[0])
+
+
+@pytest.mark.sgd
+def test_minibatch_sgd(cancer):
+    """
+    a full size mini-batch is one gradient descent step per epoch
+    """
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    gd = LogisticRegression(max_iter=50, learning_rate=1e-1, random_state=0)
+    gd.fit(X, y)
+    full = LogisticRegression(sgd=True, batch_size=X.shape[0], max_iter=50,
+                              learning_rate=1e-1, random_state=0)
+    full.fit(X, y)
+    assert np.allclose(gd.coef_, full.coef_)
+
+    clf = LogisticRegression(sgd=True, batch_size=32, max_iter=20,
+                             learning_rate=1e-1, random_state=0)
+    clf.fit(X, y)
+    assert clf.score(X, y) > 0.95
+
+
+@pytest.mark.sgd
+def test_shuffled_batches():
+    rng = np.random.RandomState(0)
+    indices = np.arange(10)
+    batches = list(shuffled_batches(indices, 4, rng))
+    assert [len(rows) for rows in batches] == [4, 4, 2]
+    assert np.array_equal(np.sort(np.concatenate(batches)), np.arange(10))
+    # the index array itself carries the order into the next epoch
+    assert np.array_equal(np.concatenate(batches), indices)
+
+
+@pytest.mark.smoke
+def test_multinomial(iris):
+    """
+    sklearn minimizes C * sum(cross-entropy) + ||w||^2 / 2,
+    which is our objective when C = 1 / c_lambda
+    """
+    X, y = iris
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    skclf = linear_model.LogisticRegression(C=1.0, tol=1e-10, max_iter=10000)
+    skclf.fit(X, y)
+    clf = LogisticRegression(multi_class='multinomial', penalty='l2',
+                             c_lambda=1.0, max_iter=5000, tol=1e-6)
+    clf.fit(X, y)
+    assert clf.costs.shape == (clf.n_iter_,)
+    proba = clf.predict_proba(X)
+    assert np.allclose(proba.sum(axis=1), 1)
+    assert np.allclose(proba, skclf.predict_proba(X), atol=1e-4)
+    assert np.array_equal(clf.predict(X), skclf.predict(X))
+
+
+@pytest.mark.parametrize("multi_class", ['ovr', 'multinomial'])
+def test_solvers(iris, multi_class):
+    """
+    newton and lbfgs should reach the gradient descent solution
+    in a fraction of the iterations
+    """
+    X, y = iris
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    params = dict(multi_class=multi_class, penalty='l2', c_lambda=1.0)
+    gd = LogisticRegression(max_iter=5000, tol=None, **params).fit(X, y)
+    assert gd.n_iter_ == 5000
+    for solver in ['newton', 'lbfgs']:
+        clf = LogisticRegression(solver=solver, tol=1e-6, **params).fit(X, y)
+        print(solver, clf.n_iter_, clf.fit_time_)
+        assert clf.n_iter_ < 50
+        assert clf.costs.shape[-1] == clf.n_iter_
+        assert np.allclose(clf.predict_proba(X), gd.predict_proba(X), atol=1e-4)
+
+
+@pytest.mark.parametrize("sgd", [False, True])
+def test_early_stopping(cancer, sgd):
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    clf = LogisticRegression(sgd=sgd, batch_size=32, learning_rate=1e-1,
+                             max_iter=20000, tol=1e-3, random_state=0)
+    clf.fit(X, y)
+    print(clf.n_iter_)
+    assert clf.n_iter_ < 20000
+    assert clf.costs.shape == (clf.n_iter_,)
+    assert clf.score(X, y) > 0.95
+
+
+@pytest.mark.parametrize("params", [dict(),
+                                    dict(sgd=True, batch_size=16),
+                                    dict(solver='newton', tol=1e-4),
+                                    dict(solver='lbfgs', tol=1e-4)])
+def test_sparse_input(iris, params):
+    """
+    csr input should train the same model as its dense copy
+    """
+    X, y = iris
+    X = X - X.mean(axis=0)
+    X[np.abs(X) < 0.5] = 0
+    dense = LogisticRegression(max_iter=200, random_state=0, **params)
+    dense.fit(X, y)
+    clf = LogisticRegression(max_iter=200, random_state=0, **params)
+    clf.fit(sparse.csr_matrix(X), y)
+    assert np.allclose(dense.coef_, clf.coef_)
+    assert np.allclose(dense.predict_proba(X),
+                       clf.predict_proba(sparse.csr_matrix(X)))
+
+
+@pytest.mark.sgd
+def test_partial_fit(cancer):
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    params = dict(sgd=True, batch_size=16, learning_rate=0.5,
+                  lr_schedule='invscaling', random_state=0)
+
+    with pytest.raises(ValueError):
+        LogisticRegression(**params).partial_fit(X, y)
+
+    # one partial_fit on all the data is one epoch of fit
+    clf = LogisticRegression(max_iter=1, **params).fit(X, y)
+    partial = LogisticRegression(**params).partial_fit(X, y, classes=[0, 1])
+    assert np.allclose(clf.coef_, partial.coef_)
+    assert partial.t_ == clf.t_
+
+    # later calls continue from the current weights and step size
+    coef = partial.coef_.copy()
+    for chunk in np.array_split(np.arange(X.shape[0]), 5):
+        partial.partial_fit(X[chunk], y[chunk])
+    assert not np.allclose(coef, partial.coef_)
+    assert partial.n_iter_ == 6
+    assert partial.costs.shape == (6,)
+    assert partial.score(X, y) > 0.95
+
+
+@pytest.mark.sgd
+@pytest.mark.parametrize("n_classes", [2, 3])
+def test_partial_fit_after_fit(iris, n_classes):
+    """partial_fit continues a fitted model, and fit restarts the stream"""
+    X, y = iris
+    X, y = X[y < n_classes], y[y < n_classes]
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    params = dict(sgd=True, batch_size=16, max_iter=50, random_state=0)
+    clf = LogisticRegression(**params).fit(X, y)
+    coef = clf.coef_.copy()
+    clf.partial_fit(X, y)
+    assert clf.coef_.shape == coef.shape and not np.allclose(clf.coef_, coef)
+    assert clf.n_iter_ == 1 and clf.n_samples_seen_ == 2 * X.shape[0]
+
+    clf = LogisticRegression(**params).partial_fit(X, y, classes=np.unique(y))
+    clf.fit(X, y).partial_fit(X, y)
+    assert clf.n_iter_ == 1
+    assert clf.costs.shape[-1] == 1
+    assert clf.score(X, y) > 0.9
+
+
+@pytest.mark.sgd
+def test_partial_fit_penalty_chunks():
+    """the penalty does not depend on the size of the chunks"""
+    X, y = datasets.make_classification(2000, 5, random_state=0)
+    params = dict(batch_size=10, penalty='l2', c_lambda=10, learning_rate=0.1,
+                  random_state=0)
+    whole = LogisticRegression(**params).partial_fit(X, y, classes=[0, 1])
+    chunked = LogisticRegression(**params)
+    for chunk in np.array_split(np.arange(X.shape[0]), 200):
+        chunked.partial_fit(X[chunk], y[chunk], classes=[0, 1])
+    assert chunked.n_samples_seen_ == whole.n_samples_seen_ == X.shape[0]
+    assert np.allclose(whole.coef_, chunked.coef_, atol=0.1)
+
+
+@pytest.mark.sgd
+@pytest.mark.parametrize("params", [dict(), dict(multi_class='multinomial'),
+                                    dict(penalty='l2', c_lambda=1.),
+                                    dict(penalty='elasticnet', c_lambda=1.),
+                                    dict(lr_schedule='invscaling')])
+def test_single_sample_sgd(iris, params):
+    """the per-sample loop of plain sgd takes the steps of the generic one"""
+    X, y = iris
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    params = dict(sgd=True, max_iter=5, learning_rate=0.1, random_state=0, **params)
+    fast = LogisticRegression(**params).fit(X, y)
+    # momentum 0 is plain sgd through the optimizer
+    generic = LogisticRegression(optimizer='momentum', momentum=0, **params).fit(X, y)
+    assert np.allclose(fast.coef_, generic.coef_)
+    assert np.allclose(fast.intercept_, generic.intercept_)
+    assert np.allclose(fast.costs, generic.costs)
+
+
+@pytest.mark.parametrize("c_lambda", [100, 2000])
+def test_partial_fit_strong_penalty(c_lambda):
+    """a strong l2 penalty on the first rows of the stream stays stable"""
+    X, y = datasets.make_classification(2000, 5, random_state=0)
+    params = dict(batch_size=10, penalty='l2', c_lambda=c_lambda,
+                  learning_rate=0.5, random_state=0)
+    whole = LogisticRegression(sgd=True, max_iter=1, **params).fit(X, y)
+    clf = LogisticRegression(**params)
+    for chunk in np.array_split(np.arange(X.shape[0]), 20):
+        clf.partial_fit(X[chunk], y[chunk], classes=[0, 1])
+        assert np.all(np.abs(clf.coef_) < 10)
+    assert np.allclose(clf.coef_, whole.coef_, atol=0.15)
+
+
+@pytest.mark.sgd
+@pytest.mark.parametrize("sgd", [False, True])
+def test_cost_every(iris, sgd):
+    """
+    skipping or subsampling the cost leaves the training unchanged
+    """
+    X, y = iris
+    params = dict(sgd=sgd, batch_size=16, max_iter=30, tol=None, random_state=0)
+    clf = LogisticRegression(**params).fit(X, y)
+    lazy = LogisticRegression(cost_every=10, cost_sample=50, **params).fit(X, y)
+    assert np.array_equal(clf.coef_, lazy.coef_)
+    assert lazy.costs.shape == (3, 3)
+    assert np.array_equal(lazy.cost_iters_, [0, 10, 20])
+
+    every = LogisticRegression(cost_every=10, **params).fit(X, y)
+    assert np.allclose(every.costs, clf.costs[:, ::10])
+    assert np.allclose(lazy.costs, every.costs, rtol=0.5)
+
+
+@pytest.mark.parametrize("penalty", ['l1', 'elasticnet'])
+def test_l1_penalty(cancer, penalty):
+    """
+    proximal gradient descent finds the same sparse coef_ as sklearn,
+    whose C is 1 / c_lambda
+    """
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    clf = LogisticRegression(penalty=penalty, l1_ratio=0.5, c_lambda=20.,
+                             max_iter=20000, tol=1e-6).fit(X, y)
+    skclf = linear_model.LogisticRegression(penalty=penalty, l1_ratio=0.5, C=1 / 20.,
+                                            solver='saga', max_iter=10000, tol=1e-8)
+    skclf.fit(X, y)
+    assert np.allclose(clf.coef_, skclf.coef_, atol=1e-3)
+    assert np.array_equal(clf.coef_ == 0, skclf.coef_ == 0)
+
+    proba = clf.predict_proba(X)
+    clf.sparsify()
+    assert sparse.issparse(clf.coef_)
+    assert clf.coef_.nnz == np.count_nonzero(skclf.coef_)
+    assert np.allclose(clf.predict_proba(X), proba)
+    assert np.allclose(clf.predict_proba(sparse.csr_matrix(X)), proba)
+    clf.densify()
+    assert np.allclose(clf.predict_proba(X), proba)
+
+    with pytest.raises(ValueError):
+        LogisticRegression(penalty=penalty, solver='lbfgs').fit(X, y)
+
+
+@pytest.mark.l2
+def test_regularization_path(cancer):
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    c_lambdas = np.logspace(0, 3, 4)
+    lambdas, coefs, intercepts, n_iters = logistic_regression_path(
+        X, y, c_lambdas, max_iter=50000, tol=1e-5)
+    assert np.array_equal(lambdas, c_lambdas[::-1])
+    assert coefs.shape == (4, 1, X.shape[1])
+    assert intercepts.shape == (4, 1)
+
+    for c_lambda, coef, n_iter in zip(lambdas, coefs, n_iters):
+        clf = LogisticRegression(penalty='l2', c_lambda=c_lambda,
+                                 max_iter=50000, tol=1e-5)
+        clf.fit(X, y)
+        print(c_lambda, 'warm:', n_iter, 'cold:', clf.n_iter_)
+        assert np.allclose(clf.coef_, coef, atol=1e-2)
+
+
+@pytest.mark.parametrize("optimizer, learning_rate", [('momentum', 1e-1),
+                                                      ('nesterov', 1e-1),
+                                                      ('adagrad', 1e-1),
+                                                      ('rmsprop', 1e-2),
+                                                      ('adam', 1e-2)])
+def test_optimizers(cancer, optimizer, learning_rate):
+    X, y = cancer
+    X = (X - X.mean(axis=0)) / X.std(axis=0)
+    sgd = LogisticRegression(max_iter=20000, learning_rate=learning_rate,
+                             tol=1e-3).fit(X, y)
+    clf = LogisticRegression(optimizer=optimizer, max_iter=20000,
+                             learning_rate=learning_rate, tol=1e-3).fit(X, y)
+    print(optimizer, 'sgd:', sgd.n_iter_, optimizer, clf.n_iter_)
+    assert clf.n_iter_ < sgd.n_iter_
+    assert clf.score(X, y) > 0.97
+
+    clf = LogisticRegression(optimizer=optimizer, sgd=True, batch_size=32,
+                             learning_rate=learning_rate, max_iter=20,
+                             random_state=0).fit(X, y)
+    assert clf.score(X, y) > 0.95
+
+
+@pytest.mark.parametrize("params", [dict(max_iter=100),
+                                    dict(sgd=True, batch_size=16, max_iter=10),
+                                    dict(loss='perceptron', sgd=True, batch_size=1,
+                                         max_iter=20)])
+def test_parallel_ovr(iris, params):
+    """
+    training the one-vs-rest classes in worker processes
+    should not change the model
+    """
+    X, y = iris
+    # the separable setosa alone in the second group, which the
+    # perceptron would finish early
+    y = 2 - y
+    serial = LogisticRegression(random_state=0, tol=None, **params).fit(X, y)
+    parallel = LogisticRegression(random_state=0, tol=None, n_jobs=2,
+                                  **params).fit(X, y)
+    assert np.allclose(serial.coef_, parallel.coef_)
+    assert np.allclose(serial.intercept_, parallel.intercept_)
+    assert parallel.costs.shape == (3, parallel.n_iter_)
@@ -0,0 +1,46 @@
+"""
+pytest -svv test_preprocessing.py
+"""
+
+import pytest
+import numpy as np
+
+from sklearn import preprocessing
+
+from learn.lm import LinearRegression, Ridge
+from learn.preprocessing import PolynomialFeatures
+from learn.utils import construct_polynomial_feats
+
+
+@pytest.mark.parametrize("degree", [0, 1, 2, 3, 5])
+@pytest.mark.parametrize("include_bias", [True, False])
+def test_polynomial_features(degree, include_bias):
+    if degree == 0 and not include_bias:
+        return
+    X = np.random.RandomState(0).randn(20, 3)
+    poly = PolynomialFeatures(degree, include_bias=include_bias).fit(X)
+    skpoly = preprocessing.PolynomialFeatures(degree, include_bias=include_bias).fit(X)
+    assert poly.n_output_features_ == skpoly.n_output_features_
+    assert np.array_equal(poly.powers_, skpoly.powers_)
+    assert np.allclose(poly.transform(X), skpoly.transform(X))
+    assert np.allclose(poly.transform(X), np.prod(X[:, np.newaxis] ** poly.powers_, axis=-1))
+
+
+def test_construct_polynomial_feats():
+    x = np.linspace(-5, 5, 11)
+    assert np.allclose(construct_polynomial_feats(x, 4), np.vander(x, 5, increasing=True))
+
+
+@pytest.mark.parametrize("reg", [LinearRegression(fit_intercept=False),
+                                 Ridge(alpha=0.1, fit_intercept=False)])
+def test_streaming_polynomial_fit(reg):
+    """chunks of the expansion fed to partial_fit fit the full expansion"""
+    rng = np.random.RandomState(0)
+    X = rng.uniform(-1, 1, (500, 2))
+    y = (np.square(X).sum(axis=1) < 0.5).astype(float)
+    poly = PolynomialFeatures(6).fit(X)
+    weights = reg.fit(poly.transform(X), y).weights.copy()
+    for rows, XP in poly.transform_chunks(X, chunk_size=64):
+        assert XP.shape == (rows.stop - rows.start, poly.n_output_features_)
+        reg.partial_fit(XP, y[rows])
+    assert np.allclose(reg.finalize().weights, weights)